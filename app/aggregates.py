@@ -0,0 +1,131 @@
+# %%
+# Tables behind the dashboard figures, built once per data version and variable.
+# The callbacks used to filter the whole news frame, group it and build the hover strings of the older
+# nowcasts with a Python lambda on every interaction. The per-variable work is done here when a snapshot is
+# loaded (see data_store.py), and the callbacks only slice the tables.
+# The tables are sorted by date with a datetime64 index, so a date range is a pair of binary searches
+# (DateIndex) rather than a comparison over the whole history. The mean weight and impact of the news by
+# topic over a range come from cumulative sums per topic (TopicSums), so their cost does not grow with the
+# length of the history either.
+import numpy as np
+import pandas as pd
+
+VARIABLES = ["RGDP", "GDP", "UNEMP"]
+NEWS_LABELS = {"Series" : "series",
+               "Dataset" : "dataset",
+               "Label" : "label",
+               "Release" : "observed",
+               "Forecast" : "forecast (prev)",  # "date", "update date",
+               "News" : "news",
+               "Weight" : "weight",
+               "Impact" : "impact",
+               "Sector" : "broad_sector",
+               "Topic" : "topic"}
+NEWS_COLUMNS = list(NEWS_LABELS.values())
+ROUNDED_COLUMNS = NEWS_COLUMNS[3:8]
+TOPIC_COLUMNS = ["sector_topic", "broad_sector", "topic"]
+
+# %%
+def annualised(x):
+    # Quarterly log-difference growth rate (%) to annualised growth (%)
+    return (np.exp(x / 100)**4 - 1) * 100
+
+def year_on_year(x):
+    # Year-on-year growth (%) from the last four quarterly log-difference growth rates (%)
+    return (np.exp(x / 100).rolling(4).apply(np.prod, raw = True) - 1) * 100
+
+def hover_list(nc_dates):
+    return "<br>   " + "   <br>   ".join(reversed(nc_dates))
+
+# %%
+class DateIndex:
+    # Sorted datetime64 dates of the rows of a table, for range selections with binary search
+    def __init__(self, dates):
+        self.dates = pd.to_datetime(pd.Series(dates)).to_numpy("datetime64[ns]")
+        if len(self.dates) and (self.dates[1:] < self.dates[:-1]).any():
+            raise ValueError("DateIndex requires dates in ascending order")
+
+    def slice(self, start_date, end_date):
+        # Positions of the rows with start_date <= date <= end_date
+        start, end = np.datetime64(pd.Timestamp(start_date), "ns"), np.datetime64(pd.Timestamp(end_date), "ns")
+        return slice(np.searchsorted(self.dates, start, "left"), np.searchsorted(self.dates, end, "right"))
+
+class TopicSums:
+    # Cumulative weight and impact of the news of each topic, along its rows sorted by date (one 1-D array per
+    # topic, with a leading 0), and their dates.
+    # News of series without a sector or topic (e.g. missing from series.csv) are left out, as by groupby
+    def __init__(self, news):
+        news = news.dropna(subset = TOPIC_COLUMNS)
+        groups = news.groupby(TOPIC_COLUMNS, sort = True)
+        self.topics = pd.DataFrame(list(groups.groups.keys()), columns = TOPIC_COLUMNS)
+        self.index, self.weight, self.impact = [], [], []
+        for _, rows in groups:
+            self.index.append(DateIndex(rows.date))
+            self.weight.append(np.r_[0, rows.weight.to_numpy().cumsum()])
+            self.impact.append(np.r_[0, rows.impact.to_numpy().cumsum()])
+
+    def means(self, start_date, end_date):
+        # Mean weight and impact by topic of the news in the date range (topics without news are dropped)
+        count, weight, impact = np.zeros(len(self.topics)), np.zeros(len(self.topics)), np.zeros(len(self.topics))
+        for k, index in enumerate(self.index):
+            rows = index.slice(start_date, end_date)
+            count[k] = rows.stop - rows.start
+            weight[k] = self.weight[k][rows.stop] - self.weight[k][rows.start]
+            impact[k] = self.impact[k][rows.stop] - self.impact[k][rows.start]
+        has_news = count > 0
+        return self.topics.loc[has_news].assign(weight = weight[has_news] / count[has_news],
+                                                impact = impact[has_news] / count[has_news]).reset_index(drop = True)
+
+# %%
+class VariableTables:
+    def __init__(self, snapshot, var):
+        self.var = var
+        news = snapshot.news.loc[snapshot.news["impacted variable"] == var]
+
+        ## Latest quarter: impacts by date and sector_topic, and the news table of every date
+        news_qx = news.loc[news.quarter == snapshot.q]
+        self.qx_impacts = news_qx.groupby(["date", "sector_topic"]).agg({"impact": "sum"}) \
+            .reset_index().sort_values("sector_topic", ascending=False)
+        qx_table = news_qx[NEWS_COLUMNS].copy()
+        qx_table[ROUNDED_COLUMNS] = qx_table[ROUNDED_COLUMNS].round(3)
+        qx_table = qx_table.rename(columns = {v: k for k, v in NEWS_LABELS.items()})
+        self.qx_records = {date: rows.to_dict("records") for date, rows in qx_table.groupby(news_qx.date.values)}
+        self.qx_nowcast = snapshot.nowcast_latest_quarter[["date", var]]
+
+        ## All nowcasts: annualised and year-on-year growth, and the hover strings of the older nowcasts
+        final, other = snapshot.nowcast_final, snapshot.nowcast_other
+        self.final = pd.DataFrame({"date": final.date, "quarter": final.quarter,
+                                   "yoy": year_on_year(final[var]), "ann": annualised(final[var])})
+        self.other = pd.DataFrame({"date": other.date, "quarter": other.quarter, "ann": annualised(other[var])})
+        self.other["nc_date"] = self.other.date + " : " + self.other.ann.round(2).astype(str)
+        self.other_hover = self.other.groupby("quarter").nc_date.agg(lambda x: hover_list(x.tolist()))
+        self.other_counts = self.other.quarter.value_counts()
+        self.gdp = pd.DataFrame({"quarter": snapshot.gdp_ld.quarter.values, "ann": annualised(snapshot.gdp_ld[var]).values,
+                                 "date": snapshot.gdp_ld.index.to_timestamp()})
+        self.final_index, self.other_index = DateIndex(self.final.date), DateIndex(self.other.date)
+        self.gdp_index = DateIndex(self.gdp.date)
+        self.topic_sums = TopicSums(news.sort_values("date", kind = "stable"))
+
+    def news_records(self, date):
+        return self.qx_records.get(date, [])
+
+    def nowcasts(self, start_date, end_date):
+        # Final nowcasts, older nowcasts (with hover strings) and outcomes in the date range
+        final = self.final.iloc[self.final_index.slice(start_date, end_date)].copy()
+        # The year-on-year rate needs four quarters within the range
+        final.iloc[:3, final.columns.get_loc("yoy")] = np.nan
+        other = self.other.iloc[self.other_index.slice(start_date, end_date)]
+        other = other.assign(nc_date_all = other.quarter.map(self.other_hover))
+        # Quarters cut by the range only list the nowcasts within it
+        counts = other.quarter.value_counts()
+        for quarter in counts.index[counts.values < self.other_counts[counts.index].values]:
+            rows = other.quarter == quarter
+            other.loc[rows, "nc_date_all"] = hover_list(other.nc_date[rows].tolist())
+        gdp = self.gdp.iloc[self.gdp_index.slice(start_date, end_date)]
+        return final, other, gdp
+
+    def topic_means(self, start_date, end_date):
+        # Mean weight and impact of the news by topic in the date range
+        news_tot = self.topic_sums.means(start_date, end_date)
+        news_tot["abs_impact"] = news_tot.impact.abs()
+        return news_tot
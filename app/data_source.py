@@ -0,0 +1,63 @@
+# %%
+# Data source of the dashboard.
+# The app used to read the four csv files from raw.githubusercontent.com at import, in every gunicorn
+# worker. Instead, the data is read from a compact local artifact: one Parquet file per table, with the
+# news already merged with the series labels. It is built from the nowcast csv files after each weekly run
+# (python app/data_source.py). Under gunicorn --preload the app, and therefore the data, is loaded once in
+# the master process and shared copy-on-write with the forked workers.
+#
+# The location is configured with the NOWCAST_DATA environment variable: a directory holding the artifact
+# (default: data/ next to this file), or a directory or base URL holding the nowcast csv files, e.g.
+# https://raw.githubusercontent.com/Stellenbosch-Econometrics/SA-Nowcast/main/nowcast
+import os
+import argparse
+import pandas as pd
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+DATA_SOURCE = os.environ.get("NOWCAST_DATA", DATA_DIR)
+TABLES = ["nowcast", "news", "gdp_logdiff"]
+
+# %%
+def is_url(source):
+    return source.startswith(("http://", "https://"))
+
+def has_artifact(source):
+    return not is_url(source) and all(os.path.exists(os.path.join(source, t + ".parquet")) for t in TABLES)
+
+def read_csv_tables(source):
+    # The tables of the dashboard from the nowcast csv files (local directory or base URL)
+    path = (lambda x: source.rstrip("/") + "/" + x) if is_url(source) else (lambda x: os.path.join(source, x))
+    nowcast = pd.read_csv(path("nowcast.csv"))
+    gdp_ld = pd.read_csv(path("gdp_logdiff.csv"))
+    gdp_ld = gdp_ld.loc[pd.PeriodIndex(gdp_ld.quarter, freq="Q") >= pd.PeriodIndex(nowcast.quarter, freq="Q").min()]
+    news = pd.read_csv(path("news.csv"))
+    series = pd.read_csv(path("series.csv"))
+    news = news.merge(series,
+                      left_on = "updated variable",
+                      right_on = "series", how = "left")
+    news["sector_topic"] = news.broad_sector + ": " + news.topic
+    return dict(nowcast = nowcast, news = news, gdp_logdiff = gdp_ld.reset_index(drop = True))
+
+def read_artifact(source):
+    return {t: pd.read_parquet(os.path.join(source, t + ".parquet")) for t in TABLES}
+
+def load_data(source = DATA_SOURCE):
+    # dict of the nowcast, news (with series labels and sector_topic) and gdp_logdiff tables
+    return read_artifact(source) if has_artifact(source) else read_csv_tables(source)
+
+# %%
+def build_artifact(nowcast_dir = "nowcast", out_dir = DATA_DIR):
+    # Writes the artifact from the nowcast csv files (strings are dictionary-encoded by Parquet)
+    os.makedirs(out_dir, exist_ok = True)
+    for table, df in read_csv_tables(nowcast_dir).items():
+        tmp = os.path.join(out_dir, "." + table + ".parquet")
+        df.to_parquet(tmp, index = False, compression = "zstd")
+        os.replace(tmp, os.path.join(out_dir, table + ".parquet"))
+    return out_dir
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Build the dashboard data artifact from the nowcast csv files")
+    parser.add_argument("--nowcast-dir", default = "nowcast")
+    parser.add_argument("--out-dir", default = DATA_DIR)
+    args = parser.parse_args()
+    print("Built dashboard data in", build_artifact(args.nowcast_dir, args.out_dir))
@@ -0,0 +1,123 @@
+# %%
+# Versioned store of the dashboard data, reloaded without restarting the workers.
+# The data and the frames derived from it are held in an immutable Snapshot. A background thread polls the
+# data source (file modification times and sizes of a local directory, ETags of a base URL) and, when it
+# changed, builds a new snapshot and swaps it in with a single reference assignment. Callbacks take the
+# current snapshot once at the start, so they always work on a consistent set of frames.
+# The thread is started lazily in each process: under gunicorn --preload the store is created in the master,
+# and threads do not survive the fork into the workers.
+import os
+import time
+import hashlib
+import threading
+import urllib.request
+from datetime import datetime
+from collections import OrderedDict
+import pandas as pd
+from data_source import DATA_SOURCE, TABLES, is_url, has_artifact, load_data
+from aggregates import VARIABLES, VariableTables
+
+# Seconds between checks of the data source (0 disables reloading)
+POLL_INTERVAL = float(os.environ.get("NOWCAST_DATA_POLL", 60))
+CSV_FILES = ["nowcast.csv", "news.csv", "gdp_logdiff.csv", "series.csv"]
+# Number of callback outputs kept per snapshot
+CACHE_SIZE = int(os.environ.get("NOWCAST_CACHE_SIZE", 256))
+
+# %%
+class Snapshot:
+    # The dashboard tables and the frames derived from them, for one version of the data
+    def __init__(self, data, version):
+        self.version = version
+        self.loaded_at = datetime.now().isoformat(timespec = "seconds")
+        self.nowcast = nowcast = data["nowcast"]
+        gdp_ld = data["gdp_logdiff"]
+        gdp_ld.index = pd.PeriodIndex(gdp_ld.quarter, freq="Q")
+        self.gdp_ld = gdp_ld
+        self.news = data["news"]
+
+        # format this to month-day
+        self.q = q = nowcast.quarter.max()
+        self.nowcast_latest_quarter = nowcast.loc[nowcast.quarter == q]
+        self.nowcast_dates = dict(zip(self.nowcast_latest_quarter.date,
+                                      pd.to_datetime(self.nowcast_latest_quarter.date).dt.strftime("%b-%d")))
+        self.all_nowcast_dates = list(nowcast.date)
+
+        nowcast_final = nowcast.copy()
+        nowcast_final.date = pd.to_datetime(nowcast_final.date)
+        final_ids = nowcast_final.groupby('quarter').date.idxmax()
+        self.nowcast_final = nowcast.iloc[final_ids] # nowcast.groupby("quarter").last().reset_index()
+        self.nowcast_other = nowcast.drop(index = final_ids)
+
+        # Per-variable tables of the figures, and memoized callback outputs (dropped with the snapshot)
+        self.tables = {var: VariableTables(self, var) for var in VARIABLES}
+        self.cache = OrderedDict()
+        self.cache_lock = threading.Lock()
+
+    def cached(self, fn, *args):
+        # fn(self, *args), memoized in a bounded LRU cache
+        key = (fn.__name__,) + args
+        with self.cache_lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+        value = fn(self, *args)
+        with self.cache_lock:
+            self.cache[key] = value
+            if len(self.cache) > CACHE_SIZE:
+                self.cache.popitem(last = False)
+        return value
+
+    def info(self):
+        return dict(version = self.version, loaded_at = self.loaded_at,
+                    latest_nowcast = self.all_nowcast_dates[-1], quarter = self.q)
+
+# %%
+def source_version(source = DATA_SOURCE):
+    # Short fingerprint of the current state of the data source
+    if is_url(source):
+        tags = []
+        for name in CSV_FILES:
+            request = urllib.request.Request(source.rstrip("/") + "/" + name, method = "HEAD")
+            with urllib.request.urlopen(request, timeout = 10) as response:
+                tags.append(response.headers.get("ETag") or response.headers.get("Last-Modified") or "")
+    else:
+        names = [t + ".parquet" for t in TABLES] if has_artifact(source) else CSV_FILES
+        stats = [os.stat(os.path.join(source, name)) for name in names]
+        tags = [f"{name}:{st.st_mtime_ns}:{st.st_size}" for name, st in zip(names, stats)]
+    return hashlib.sha1("|".join(tags).encode()).hexdigest()[:12]
+
+class DataStore:
+    def __init__(self, source = DATA_SOURCE, interval = POLL_INTERVAL):
+        self.source = source
+        self.interval = interval
+        self.snapshot = Snapshot(load_data(source), source_version(source))
+        self.lock = threading.Lock()
+        self.pid = None
+
+    def get(self):
+        # The current snapshot (starts the polling thread in this process if needed)
+        if self.interval > 0 and self.pid != os.getpid():
+            with self.lock:
+                if self.pid != os.getpid():
+                    self.pid = os.getpid()
+                    threading.Thread(target = self.poll_forever, daemon = True, name = "data-store").start()
+        return self.snapshot
+
+    def refresh(self):
+        # Reloads the data if the source changed; returns True if a new snapshot was swapped in
+        version = source_version(self.source)
+        if version == self.snapshot.version:
+            return False
+        snapshot = Snapshot(load_data(self.source), version)
+        # The data may have changed again while loading: the next poll will pick that up
+        self.snapshot = snapshot
+        print(f"Loaded data version {version} (latest nowcast {snapshot.all_nowcast_dates[-1]})", flush = True)
+        return True
+
+    def poll_forever(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.refresh()
+            except Exception as e:  # Keep serving the current snapshot, e.g. while files are being written
+                print(f"Data reload failed, serving version {self.snapshot.version}: {e}", flush = True)
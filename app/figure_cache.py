@@ -0,0 +1,282 @@
+# %%
+# Figure cache of the dashboard, shared by the gunicorn workers.
+# The figures of a callback only depend on the data version and the callback inputs, so the responses of
+# Dash's /_dash-update-component are cached by (data version, callback outputs, inputs, state): the response
+# body (the figures already serialized to JSON) is stored gzip-compressed, and a repeated view is answered
+# before Dash runs the callback, without building or serializing any figure. Other responses are compressed
+# by Flask-Compress.
+# The backend is set with NOWCAST_FIGURE_CACHE:
+#   disk (default)         files under NOWCAST_FIGURE_CACHE_DIR (default <tmp>/nowcast-figures), shared by the
+#                          workers on a host
+#   redis://host:port/db   a Redis-compatible server (needs the redis package), shared across hosts
+#   memory                 a dict in each worker, e.g. for local runs and tests
+#   off                    no caching
+# Hits, misses and stores are counted per worker; /cache-stats reports them for this worker and summed over
+# all workers that share the backend.
+import os
+import json
+import gzip
+import time
+import shutil
+import socket
+import hashlib
+import tempfile
+import threading
+from flask import request, g, Response, jsonify
+
+FIGURE_CACHE = os.environ.get("NOWCAST_FIGURE_CACHE", "disk")
+FIGURE_CACHE_DIR = os.environ.get("NOWCAST_FIGURE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "nowcast-figures"))
+# Seconds an entry is kept in Redis (entries of older data versions are never requested again)
+FIGURE_CACHE_TTL = int(os.environ.get("NOWCAST_FIGURE_CACHE_TTL", 7 * 24 * 3600))
+COMPRESS_LEVEL = 6
+# Seconds between writes of the counters of a worker to the backend
+STATS_INTERVAL = 5
+
+# %%
+class MemoryBackend:
+    # Local stand-in for the shared backends: the same interface on a dict
+    def __init__(self):
+        self.data = {}
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def get(self, version, key):
+        return self.data.get((version, key))
+
+    def set(self, version, key, value):
+        with self.lock:
+            self.data[(version, key)] = value
+
+    def new_version(self, version):
+        # Drops the entries of other data versions
+        with self.lock:
+            self.data = {k: v for k, v in self.data.items() if k[0] == version}
+
+    def put_stats(self, worker, stats):
+        self.stats[worker] = stats
+
+    def all_stats(self):
+        return dict(self.stats)
+
+class DiskBackend:
+    # One file per entry in a directory per data version, written atomically
+    def __init__(self, directory = FIGURE_CACHE_DIR):
+        self.directory = directory
+        os.makedirs(os.path.join(directory, "stats"), exist_ok=True)
+
+    def path(self, version, key):
+        return os.path.join(self.directory, version, key + ".json.gz")
+
+    def get(self, version, key):
+        try:
+            with open(self.path(version, key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def write(self, path, value):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=".tmp-", dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(value)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def set(self, version, key, value):
+        self.write(self.path(version, key), value)
+
+    def versions(self):
+        # Data versions in the order the workers first loaded them (one per line, appended)
+        try:
+            with open(os.path.join(self.directory, "versions.txt")) as f:
+                return list(dict.fromkeys(line.strip() for line in f if line.strip()))
+        except FileNotFoundError:
+            return []
+
+    def new_version(self, version):
+        # Drops the entries of the versions loaded before this one. During a rollout some workers are still on
+        # an older version: their entries are dropped when they move on, and they never drop newer ones.
+        versions = self.versions()
+        if version not in versions:
+            with open(os.path.join(self.directory, "versions.txt"), "a") as f:
+                f.write(version + "\n")
+            versions = self.versions()
+        newer = set(versions[versions.index(version):])
+        for name in os.listdir(self.directory):
+            if name not in newer and name != "stats" and os.path.isdir(os.path.join(self.directory, name)):
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+    def put_stats(self, worker, stats):
+        self.write(os.path.join(self.directory, "stats", worker + ".json"), json.dumps(stats).encode())
+
+    def all_stats(self):
+        stats = {}
+        for name in os.listdir(os.path.join(self.directory, "stats")):
+            if name.endswith(".json"):
+                try:
+                    with open(os.path.join(self.directory, "stats", name)) as f:
+                        stats[name[:-5]] = json.load(f)
+                except (OSError, ValueError):
+                    pass
+        return stats
+
+class RedisBackend:
+    # Entries and counters as keys of a Redis-compatible server
+    def __init__(self, url, ttl = FIGURE_CACHE_TTL, prefix = "nowcast:"):
+        import redis  # optional dependency, only needed for this backend
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, version, key):
+        return self.client.get(f"{self.prefix}fig:{version}:{key}")
+
+    def set(self, version, key, value):
+        self.client.set(f"{self.prefix}fig:{version}:{key}", value, ex = self.ttl)
+
+    def new_version(self, version):
+        pass  # Entries of older versions expire
+
+    def put_stats(self, worker, stats):
+        self.client.hset(f"{self.prefix}stats", worker, json.dumps(stats))
+
+    def all_stats(self):
+        return {k.decode(): json.loads(v) for k, v in self.client.hgetall(f"{self.prefix}stats").items()}
+
+def make_backend(spec = FIGURE_CACHE):
+    if spec == "off":
+        return None
+    if spec == "memory":
+        return MemoryBackend()
+    if spec.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend(spec)
+    return DiskBackend(FIGURE_CACHE_DIR if spec == "disk" else spec)
+
+# %%
+class FigureCache:
+    def __init__(self, store, backend):
+        # store: the DataStore whose snapshot version keys the entries
+        self.store = store
+        self.backend = backend
+        self.version = None
+        self.stats = dict(hits = 0, misses = 0, stores = 0, errors = 0, bytes_served = 0)
+        self.stats_written = 0
+        self.lock = threading.Lock()
+
+    @property
+    def worker(self):
+        # Per process: the cache is created in the gunicorn master, before the workers are forked
+        return f"{socket.gethostname()}-{os.getpid()}"
+
+    def count(self, **increments):
+        with self.lock:
+            for name, n in increments.items():
+                self.stats[name] += n
+            if time.monotonic() - self.stats_written > STATS_INTERVAL:
+                self.stats_written = time.monotonic()
+                stats = dict(self.stats)
+            else:
+                stats = None
+        if stats is not None:
+            try:
+                self.backend.put_stats(self.worker, stats)
+            except Exception:
+                pass
+
+    def request_key(self):
+        # Key of a callback request: its outputs, inputs and state (not which input triggered it)
+        body = request.get_json(silent = True)
+        if not isinstance(body, dict):
+            return None
+        spec = json.dumps([body.get("output"), body.get("inputs"), body.get("state")], sort_keys = True)
+        return hashlib.sha1(spec.encode()).hexdigest()
+
+    def before_request(self):
+        key = self.request_key()
+        if key is None:
+            return None
+        version = self.store.get().version
+        if version != self.version:
+            self.version = version
+            try:
+                self.backend.new_version(version)
+            except Exception:
+                pass
+        try:
+            value = self.backend.get(version, key)
+        except Exception as e:  # The dashboard keeps working without the cache
+            print(f"Figure cache read failed: {e}", flush = True)
+            self.count(errors = 1)
+            value = None
+        if value is None:
+            g.figure_cache = (version, key)
+            self.count(misses = 1)
+            return None
+        self.count(hits = 1, bytes_served = len(value))
+        if "gzip" in request.headers.get("Accept-Encoding", ""):
+            response = Response(value, mimetype = "application/json")
+            response.headers["Content-Encoding"] = "gzip"
+        else:
+            response = Response(gzip.decompress(value), mimetype = "application/json")
+        response.headers["Vary"] = "Accept-Encoding"
+        response.headers["X-Figure-Cache"] = "hit"
+        return response
+
+    def after_request(self, response):
+        entry = g.pop("figure_cache", None)
+        if entry is None or response.status_code != 200 or response.direct_passthrough or \
+                "Content-Encoding" in response.headers:
+            return response
+        version, key = entry
+        # Not stored if the data changed while the callback ran: the response may be from the new version
+        if self.store.get().version == version:
+            try:
+                self.backend.set(version, key, gzip.compress(response.get_data(), COMPRESS_LEVEL))
+                self.count(stores = 1)
+            except Exception as e:
+                print(f"Figure cache write failed: {e}", flush = True)
+                self.count(errors = 1)
+        response.headers["X-Figure-Cache"] = "miss"
+        return response
+
+    def report(self):
+        with self.lock:
+            worker = dict(self.stats)
+        try:
+            workers = self.backend.all_stats()
+        except Exception:
+            workers = {}
+        workers[self.worker] = worker
+        total = {name: sum(s.get(name, 0) for s in workers.values()) for name in worker}
+        lookups = total["hits"] + total["misses"]
+        return dict(backend = type(self.backend).__name__, version = self.version, worker = self.worker,
+                    this_worker = worker, all_workers = total, workers = len(workers),
+                    hit_rate = total["hits"] / lookups if lookups else None)
+
+def install(server, store, path = "/_dash-update-component", backend = None):
+    # Serves the callback responses of a Dash app on this Flask server from the cache, and returns the cache
+    # (None if caching is off). Call it after Compress(server): after_request functions run in reverse order,
+    # so responses are stored before Flask-Compress compresses them
+    backend = make_backend() if backend is None else backend
+    if backend is None:
+        return None
+    cache = FigureCache(store, backend)
+
+    @server.before_request
+    def figure_cache_lookup():
+        if request.method == "POST" and request.path == path:
+            return cache.before_request()
+
+    @server.after_request
+    def figure_cache_store(response):
+        return cache.after_request(response)
+
+    @server.route("/cache-stats")
+    def cache_stats():
+        return jsonify(cache.report())
+
+    return cache
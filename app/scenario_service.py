@@ -0,0 +1,69 @@
+# %%
+# Optional what-if endpoint of the dashboard: POST /scenarios with {"scenarios": {name: {series: {period: value}}}}
+# returns the nowcasts and news of the scenarios on the latest vintage (see code/scenarios.py).
+# The dashboard itself only needs the nowcast tables, so the endpoint is off unless NOWCAST_MODEL_ROOT points
+# to a checkout of the repository with the vintages and the estimates stored by the weekly run (cache/dfm),
+# and statsmodels is installed. The fitted results of the latest vintage (a few hundred MB) are restored on
+# the first request in each worker, and again when a new vintage arrives.
+import os
+import sys
+import threading
+
+MODEL_ROOT = os.environ.get("NOWCAST_MODEL_ROOT")
+# Largest number of scenarios in a request
+MAX_SCENARIOS = int(os.environ.get("NOWCAST_MAX_SCENARIOS", 1000))
+
+# %%
+class ScenarioService:
+    def __init__(self, root = MODEL_ROOT):
+        self.root = root
+        self.engine = None
+        self.lock = threading.Lock()
+        self.error = None
+        self.module = None
+        if root is None:
+            self.error = "The scenario endpoint is not enabled (set NOWCAST_MODEL_ROOT)"
+            return
+        code_dir = os.path.join(root, "code")
+        if code_dir not in sys.path:
+            sys.path.insert(0, code_dir)
+        try:
+            import scenarios  # needs statsmodels
+        except ImportError as e:
+            self.error = f"The scenario endpoint is not available: {e}"
+            return
+        self.module = scenarios
+
+    @property
+    def available(self):
+        return self.error is None
+
+    def get_engine(self):
+        # The engine on the latest vintage, rebuilt when there is a newer one
+        from nowcast_model import list_vintages
+        vintage_dir = os.path.join(self.root, "vintages")
+        latest = list_vintages(vintage_dir)[-1]
+        with self.lock:
+            if self.engine is None or self.engine.vintage != latest:
+                self.engine = None  # Release the old results before restoring the new ones
+                self.engine = self.module.latest_engine(vintage_dir, params_dir = os.path.join(self.root, "cache", "dfm"),
+                                                        cache_dir = os.path.join(self.root, "cache", "vintages"))
+            return self.engine
+
+    def run(self, payload):
+        # JSON-ready nowcasts and news of a request; ValueError for invalid requests
+        scenarios = (payload or {}).get("scenarios")
+        if not isinstance(scenarios, dict) or not scenarios:
+            raise ValueError('Expected {"scenarios": {name: {series: {period: value}}}}')
+        if len(scenarios) > MAX_SCENARIOS:
+            raise ValueError(f"At most {MAX_SCENARIOS} scenarios per request")
+        try:
+            table = self.module.scenario_table(scenarios)
+        except (AttributeError, TypeError) as e:
+            raise ValueError(f"Invalid scenarios: {e}")
+        engine = self.get_engine()
+        with self.lock:  # The results are not safe to use from several threads at once
+            nowcasts, news = engine.run(table)
+        news["impact date"] = news["impact date"].astype(str)
+        return dict(vintage = engine.vintage, quarter = str(engine.quarter),
+                    nowcasts = nowcasts.to_dict("records"), news = news.to_dict("records"))
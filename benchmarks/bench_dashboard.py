@@ -0,0 +1,168 @@
+# %%
+# Benchmarks of the dashboard callbacks on the committed data and on synthetic data with 10x and 100x the news.
+# A synthetic history repeats the nowcast, news and outcome tables, each copy shifted back in time by the span
+# of the data, so the latest quarter (and the first tab) is unchanged while the ranges of the second tab grow.
+# Beyond 10x, the news of every date is also repeated for synthetic copies of the series.
+# Each callback is timed three ways: as served from the memoized outputs of the snapshot (cached), on a cache
+# miss (uncached), and with the logic of the original callbacks, which filtered and grouped the full tables on
+# every call (baseline).
+import os
+os.environ.setdefault("NOWCAST_DATA_POLL", "0")  # no reloading thread while benchmarking
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+from common import add_paths
+add_paths()
+from data_source import load_data
+from data_store import Snapshot
+from aggregates import NEWS_LABELS, NEWS_COLUMNS, TOPIC_COLUMNS, TopicSums, annualised, year_on_year
+import app
+
+SCALES = [1, 10, 100]
+MAX_PERIODS = 10
+VARIABLES = ["RGDP", "GDP", "UNEMP"]
+
+# %%
+def shift_back(df, quarters, date_columns = ("date",)):
+    df = df.copy()
+    df["quarter"] = (pd.PeriodIndex(df.quarter, freq="Q") - quarters).astype(str)
+    for col in date_columns:
+        df[col] = (pd.to_datetime(df[col]) - pd.DateOffset(months = 3 * quarters)).dt.strftime("%Y-%m-%d")
+    return df
+
+def widen(news, copies):
+    # The news with every row repeated for `copies` synthetic series
+    return pd.concat([news.assign(**{"updated variable": news["updated variable"] + f"_{j}", "series": news.series + f"_{j}"})
+                      for j in range(copies)]).sort_values("date", kind = "stable").reset_index(drop = True)
+
+def synthetic_data(data, scale):
+    # The dashboard tables with `scale` times as many news rows: a history up to MAX_PERIODS times as long
+    # (copies further back would predate the range of datetime64), and more series per date for the rest
+    periods = min(scale, MAX_PERIODS)
+    quarters = pd.PeriodIndex(data["nowcast"].quarter, freq="Q")
+    span = quarters.max().ordinal - quarters.min().ordinal + 1
+    copies = range(periods - 1, -1, -1)
+    news = pd.concat([shift_back(data["news"], k * span) for k in copies], ignore_index = True)
+    return dict(nowcast = pd.concat([shift_back(data["nowcast"], k * span) for k in copies], ignore_index = True),
+                news = news if scale == periods else widen(news, scale // periods),
+                gdp_logdiff = pd.concat([shift_back(data["gdp_logdiff"], k * span, ()) for k in copies], ignore_index = True))
+
+def check_topic_means(news, var = "RGDP"):
+    # The topic means of TopicSums against a groupby over the rows in range, with one series unmatched in
+    # series.csv (no sector or topic), as after a quarter drops a series
+    news = news.loc[news["impacted variable"] == var].sort_values("date", kind = "stable").copy()
+    news.loc[news["updated variable"] == news["updated variable"].iloc[0], TOPIC_COLUMNS] = None
+    sums = TopicSums(news)
+    dates = news.date.drop_duplicates().tolist()
+    for start, end in [(dates[0], dates[-1]), (dates[len(dates) // 2], dates[-1])]:
+        rows = news.loc[(pd.to_datetime(news.date) >= pd.Timestamp(start)) & (pd.to_datetime(news.date) <= pd.Timestamp(end))]
+        expected = rows.groupby(TOPIC_COLUMNS).agg({"weight": "mean", "impact": "mean"}).reset_index()
+        means = sums.means(start, end)
+        if len(means) != len(expected) or not (means[TOPIC_COLUMNS].values == expected[TOPIC_COLUMNS].values).all() or \
+                not np.allclose(means[["weight", "impact"]], expected[["weight", "impact"]], rtol = 1e-9, atol = 1e-12):
+            raise ValueError(f"TopicSums means differ from the groupby means from {start} to {end}")
+
+# %%
+# The original callbacks, on the tables of a snapshot (kept to measure the speedup)
+def baseline_nccq_graphs(snapshot, var, date):
+    news = snapshot.news
+    news_qx = news.loc[(news.quarter == snapshot.q) & (news["impacted variable"] == var)]
+    news_latest_quarter = news_qx.groupby(["date", "sector_topic"]).agg({"impact": "sum"}) \
+        .reset_index().sort_values("sector_topic", ascending=False)
+    fig_qx = px.bar(news_latest_quarter, x="date", y="impact", color="sector_topic", barmode="relative")
+    nowcast_qx = snapshot.nowcast_latest_quarter
+    fig_qx.add_trace(go.Scatter(x=nowcast_qx.date, y=nowcast_qx[var], line=dict(color="white"),
+                                mode='lines+markers', name='Nowcast'))
+    fig_qx.update_layout(title='Nowcast for ' + snapshot.q, xaxis_title='Date',
+                         yaxis_title='Quarterly Log-Difference Growth Rate (%)', legend_title = "Sector: Topic",
+                         hovermode="x", hoverlabel = dict(namelength = -1), autosize=False, width=1200, height=500,
+                         margin=dict(l=20, r=20, t=40, b=20), template="plotly_dark")
+    fig_qx.update_yaxes(hoverformat=".2f")
+    fig_qx.update_traces(hovertemplate=None)
+    records = news_qx.loc[news_qx.date == date, NEWS_COLUMNS]
+    records[NEWS_COLUMNS[3:8]] = records[NEWS_COLUMNS[3:8]].transform(lambda x: x.round(3))
+    records = records.rename(columns={v: k for k, v in NEWS_LABELS.items()}).to_dict('records')
+    return fig_qx, records
+
+def baseline_allnc_graphs(snapshot, var, start_date, end_date):
+    final, other, gdp_ld, news = snapshot.nowcast_final, snapshot.nowcast_other, snapshot.gdp_ld, snapshot.news
+    final_range = final.loc[(final.date >= start_date) & (final.date <= end_date)]
+    other_range = other.loc[(other.date >= start_date) & (other.date <= end_date)].copy()
+    gdp_dates = gdp_ld.index.to_timestamp()
+    gdp_range = gdp_ld.loc[(gdp_dates >= start_date) & (gdp_dates <= end_date)]
+    other_range["nc_date"] = other_range.date.astype(str) + " : " + annualised(other_range[var]).round(2).astype(str)
+    other_range["nc_date_all"] = other_range.groupby("quarter").nc_date.transform(
+        lambda x: "<br>   " + "   <br>   ".join(reversed(x.tolist())))
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(x=final_range.quarter, y=year_on_year(final_range[var]), customdata=final_range.date,
+                             hovertemplate="<br>   %{customdata} : %{y:.2f}", mode='lines+markers',
+                             marker=dict(color='cyan'), name='Nowcast (YoY%)'))
+    fig.add_trace(go.Scatter(x=other_range.quarter, y=annualised(other_range[var]), customdata=other_range.nc_date_all,
+                             hovertemplate="%{customdata}", mode='markers', marker=dict(color='red'),
+                             name='Older Nowcasts'))
+    fig.add_trace(go.Scatter(x=final_range.quarter, y=annualised(final_range[var]), customdata=final_range.date,
+                             hovertemplate="<br>   %{customdata} : %{y:.2f}", mode='lines+markers',
+                             marker=dict(color='orange'), name='Nowcast'))
+    fig.add_trace(go.Scatter(x=gdp_range.quarter, y=annualised(gdp_range[var]), hovertemplate="%{y:.2f}",
+                             mode='lines+markers', marker=dict(color='green'), name='Outcome'))
+    fig.update_layout(title='All Nowcasts (+ Backtesting 2019Q2-2023Q1)', xaxis_title='Quarter',
+                      yaxis_title='Quarterly Annualised Growth Rate (%)', hovermode="x unified",
+                      legend_traceorder="reversed", autosize=False, width=750, height=500,
+                      margin=dict(l=20, r=20, t=40, b=20), template="plotly_dark")
+    fig.update_xaxes(categoryorder='array', categoryarray=final_range.quarter)
+    news_tot = news.loc[(news.date >= start_date) & (news.date <= end_date) & (news["impacted variable"] == var)] \
+        .groupby(TOPIC_COLUMNS).agg({"weight": "mean", "impact": "mean"}).reset_index()
+    news_tot["abs_impact"] = news_tot.impact.abs()
+    tot_news_fig = go.Figure()
+    tot_news_fig.add_bar(x=news_tot.sector_topic, y=news_tot.abs_impact * 4)
+    tot_news_fig.update_layout(title='Average Absolute News Impact', xaxis_title='', yaxis_title='Average Absolute Impact',
+                               barmode='stack', hovermode="x", autosize=False, width=750, height=500,
+                               margin=dict(l=20, r=20, t=40, b=20), template="plotly_dark")
+    return fig, tot_news_fig
+
+# %%
+def bench_callbacks(results, scales = SCALES):
+    data = load_data()
+    check_topic_means(data["news"])
+    for scale in scales:
+        tables = synthetic_data(data, scale)
+        name = f"dashboard/{scale}x"
+        snapshot = results.run(f"{name}/snapshot", lambda: Snapshot({k: v.copy() for k, v in tables.items()}, name),
+                               repeat = 1, news_rows = len(tables["news"]))
+        dates = snapshot.all_nowcast_dates
+        latest = list(snapshot.nowcast_dates)[-1]
+        year_ago = (pd.Timestamp(dates[-1]) - pd.DateOffset(years = 1)).strftime("%Y-%m-%d")
+
+        ## Baseline: the original callbacks, filtering and grouping the full tables
+        results.run(f"{name}/nccq_baseline",
+                    lambda s = snapshot: [baseline_nccq_graphs(s, var, latest) for var in VARIABLES], repeat = 3)
+        results.run(f"{name}/allnc_full_range_baseline",
+                    lambda s = snapshot: [baseline_allnc_graphs(s, var, dates[0], dates[-1]) for var in VARIABLES],
+                    repeat = 3)
+        results.run(f"{name}/allnc_last_year_baseline",
+                    lambda s = snapshot: [baseline_allnc_graphs(s, var, year_ago, dates[-1]) for var in VARIABLES],
+                    repeat = 3)
+
+        ## Uncached: the work of a callback on its first call with these inputs
+        results.run(f"{name}/nccq", lambda s = snapshot: [app.nccq_graphs(s, var, latest) for var in VARIABLES],
+                    repeat = 3)
+        results.run(f"{name}/allnc_full_range",
+                    lambda s = snapshot: [app.allnc_graphs(s, var, dates[0], dates[-1]) for var in VARIABLES], repeat = 3)
+        results.run(f"{name}/allnc_last_year",
+                    lambda s = snapshot: [app.allnc_graphs(s, var, year_ago, dates[-1]) for var in VARIABLES], repeat = 3)
+
+        ## The callbacks themselves: on a cache miss (the memoized outputs cleared before each call), and served
+        ## from the memoized outputs of the snapshot
+        app.store.snapshot = snapshot
+        def uncached(callback, *args, s = snapshot):
+            s.cache.clear()
+            return [callback(var, *args) for var in VARIABLES]
+        results.run(f"{name}/update_nccq_graphs_uncached", lambda: uncached(app.update_nccq_graphs, latest), repeat = 3)
+        results.run(f"{name}/update_allnc_graphs_uncached",
+                    lambda: uncached(app.update_allnc_graphs, dates[0], dates[-1]), repeat = 3)
+        results.run(f"{name}/update_nccq_graphs_cached",
+                    lambda: [app.update_nccq_graphs(var, latest) for var in VARIABLES], repeat = 5, warmup = 1)
+        results.run(f"{name}/update_allnc_graphs_cached",
+                    lambda: [app.update_allnc_graphs(var, dates[0], dates[-1]) for var in VARIABLES], repeat = 5, warmup = 1)
+        del snapshot
@@ -0,0 +1,85 @@
+# %%
+# Benchmarks of the nowcasting pipeline on the committed vintages: loading the workbooks, the DFM fit on the
+# first vintage of a quarter, the refits on later vintages of the quarter, the nowcast and the news.
+# The quarter is fixed (2023Q2 by default, which has revisions between vintages) so results stay comparable
+# between commits as new vintages are added.
+import os
+import tempfile
+import warnings
+import pandas as pd
+from statsmodels.tools.sm_exceptions import ConvergenceWarning
+from common import ROOT
+from nowcast_model import (load_vintage, list_vintages, vintage_date, dfm_model, refit_model, quarter_month,
+                           compute_news, NOWCAST_VARIABLES)
+from model_store import warm_start, fit_warm, restore_results, em_iterations
+
+VINTAGE_DIR = os.path.join(ROOT, "vintages")
+QUARTER = "2023Q2"
+
+# %%
+def quarter_vintages(vintage_dir, quarter):
+    # First, previous and latest vintage of the quarter
+    quarter = pd.Period(quarter, freq="Q")
+    vintages = [v for v in list_vintages(vintage_dir) if pd.Period(vintage_date(v), freq="Q") == quarter]
+    if len(vintages) < 3:
+        raise ValueError(f"Need at least 3 vintages in {quarter}, found {len(vintages)}")
+    return quarter, vintages[0], vintages[-2], vintages[-1]
+
+def model_data(path, cache_dir):
+    # What a refit reads of a vintage (vintages are loaded lazily, sheet by sheet)
+    vintage = load_vintage(path, cache_dir)
+    return vintage["data_logdiff"], vintage["gdp_logdiff"]
+
+def bench_load(results, vintage_dir = VINTAGE_DIR, n = None):
+    vintages = list_vintages(vintage_dir)[-n:] if n else list_vintages(vintage_dir)
+    paths = [os.path.join(vintage_dir, v) for v in vintages]
+    results.run("load_vintage/excel", lambda: [model_data(p, cache_dir = None) for p in paths],
+                repeat = 1, vintages = len(paths))
+    with tempfile.TemporaryDirectory() as cache_dir:
+        results.run("load_vintage/cache_build", lambda: [model_data(p, cache_dir) for p in paths],
+                    repeat = 1, vintages = len(paths))
+        results.run("load_vintage/cached", lambda: [model_data(p, cache_dir) for p in paths],
+                    repeat = 3, vintages = len(paths))
+        results.run("load_vintage/cached_all_sheets", lambda: [dict(load_vintage(p, cache_dir)) for p in paths],
+                    repeat = 3, vintages = len(paths))
+
+def bench_model(results, vintage_dir = VINTAGE_DIR, quarter = QUARTER, maxiter = None):
+    quarter, first, previous, latest = quarter_vintages(vintage_dir, quarter)
+    fit_kwargs = dict(disp = False) if maxiter is None else dict(disp = False, maxiter = maxiter)
+    if maxiter is not None:
+        warnings.simplefilter("ignore", ConvergenceWarning)
+    first_data, previous_data, latest_data = [load_vintage(os.path.join(vintage_dir, v)) for v in (first, previous, latest)]
+
+    ## First vintage: cold fit, and a warm start from its own estimates
+    dfm_first = dfm_model(first_data)
+    first_results = results.run("fit/first_vintage", lambda: dfm_first.fit(**fit_kwargs), repeat = 1, vintage = first)
+    results.annotate("fit/first_vintage", em_iterations = em_iterations(first_results))
+    refit = results.run("fit/first_vintage_warm", lambda: fit_warm(dfm_first, warm_start(first_results), **fit_kwargs),
+                        repeat = 1)
+    results.annotate("fit/first_vintage_warm", em_iterations = em_iterations(refit))
+    del refit
+    fast = results.run("fit/first_vintage_squarem", lambda: fit_warm(dfm_first, method = "squarem", **fit_kwargs),
+                       repeat = 1, vintage = first)
+    results.annotate("fit/first_vintage_squarem", em_iterations = em_iterations(fast),
+                     llf_difference = round(float(fast.llf - first_results.llf), 4))
+    del fast
+
+    ## Later vintages: apply(refit=True) as in statsmodels, the warm-started refit and the filter-only update
+    apply = lambda data: first_results.apply(endog = data["data_logdiff"],
+                                             endog_quarterly = data["gdp_logdiff"][NOWCAST_VARIABLES],
+                                             refit = True, retain_standardization = True,
+                                             fit_kwargs = dict(fit_kwargs))  # apply adds start_params to it
+    refit = results.run("apply/refit", lambda: apply(latest_data), repeat = 1, vintage = latest)
+    results.annotate("apply/refit", em_iterations = em_iterations(refit))
+    del refit
+    dfm_latest = refit_model(dfm_first, latest_data)
+    latest_results = results.run("apply/refit_warm", lambda: fit_warm(dfm_latest, warm_start(first_results), **fit_kwargs),
+                                 repeat = 1, vintage = latest)
+    results.annotate("apply/refit_warm", em_iterations = em_iterations(latest_results))
+    dfm_previous = refit_model(dfm_first, previous_data)
+    previous_results = results.run("apply/filter", lambda: restore_results(dfm_previous, warm_start(first_results)),
+                                   repeat = 3, vintage = previous)
+
+    ## Nowcast and news
+    results.run("get_prediction", lambda: latest_results.get_prediction(start = quarter_month(quarter)), repeat = 5)
+    results.run("news", lambda: compute_news(latest_results, previous_results, quarter), repeat = 3)
@@ -0,0 +1,104 @@
+# %%
+# Timing and result files shared by the benchmarks (see run_benchmarks.py)
+import os
+import sys
+import json
+import time
+import platform
+import subprocess
+import statistics
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+def add_paths():
+    # The pipeline and app modules import each other by name, as when the scripts are run from the repo root
+    for path in [os.path.join(ROOT, "code"), os.path.join(ROOT, "app")]:
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+add_paths()
+
+# %%
+def measure(fn, repeat = 3, warmup = 0):
+    # Wall-clock seconds of `repeat` calls of fn (after `warmup` untimed calls), and the last return value
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = fn()
+        times.append(time.perf_counter() - start)
+    return dict(min = min(times), median = statistics.median(times), mean = statistics.mean(times),
+                repeat = repeat), value
+
+class Results:
+    # Named timings of one benchmark run, with the commit and machine they were measured on
+    def __init__(self):
+        self.benchmarks = {}
+
+    def add(self, name, timing, **info):
+        self.benchmarks[name] = dict(timing, **info)
+        extra = ", ".join(f"{k}={v}" for k, v in info.items())
+        print(f"{name:<45} median {timing['median']:10.4g}s  min {timing['min']:10.4g}s" + (f"  ({extra})" if extra else ""),
+              flush = True)
+
+    def annotate(self, name, **info):
+        # Information about a benchmark known after running it (e.g. the number of EM iterations)
+        self.benchmarks[name].update(info)
+        print(f"{'':<45} " + ", ".join(f"{k}={v}" for k, v in info.items()))
+
+    def run(self, name, fn, repeat = 3, warmup = 0, **info):
+        timing, value = measure(fn, repeat, warmup)
+        self.add(name, timing, **info)
+        return value
+
+    def to_dict(self):
+        return dict(commit = git_commit(), dirty = git_dirty(), date = datetime.now().isoformat(timespec="seconds"),
+                    python = platform.python_version(), platform = platform.platform(),
+                    processor = platform.processor() or platform.machine(), cpus = os.cpu_count(),
+                    benchmarks = self.benchmarks)
+
+    def write(self, results_dir = RESULTS_DIR):
+        data = self.to_dict()
+        os.makedirs(results_dir, exist_ok=True)
+        path = os.path.join(results_dir, f"{data['commit']}{'-dirty' if data['dirty'] else ''}.json")
+        with open(path, "w") as f:
+            json.dump(data, f, indent=1)
+        print("Wrote", path)
+        return path
+
+# %%
+def git(*args):
+    try:
+        return subprocess.run(["git", *args], cwd = ROOT, capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+def git_commit():
+    return git("rev-parse", "--short", "HEAD") or "unknown"
+
+def git_dirty():
+    return bool(git("status", "--porcelain", "--untracked-files=no"))
+
+def load_results(path):
+    # A results file, given by path or by commit
+    if not os.path.exists(path):
+        path = os.path.join(RESULTS_DIR, path if path.endswith(".json") else path + ".json")
+    with open(path) as f:
+        return json.load(f)
+
+def compare(base, new, threshold = 0.1):
+    # Table of the median times of two result files; changes beyond the threshold are flagged
+    base, new = load_results(base), load_results(new)
+    print(f"{'benchmark':<45} {base['commit']:>12} {new['commit']:>12}   ratio")
+    for name in sorted(set(base["benchmarks"]) | set(new["benchmarks"])):
+        a, b = base["benchmarks"].get(name), new["benchmarks"].get(name)
+        if a is None or b is None:
+            print(f"{name:<45} {'-' if a is None else format(a['median'], '12.4g'):>12} " +
+                  f"{'-' if b is None else format(b['median'], '12.4g'):>12}")
+            continue
+        ratio = b["median"] / a["median"] if a["median"] > 0 else float("nan")
+        flag = "  slower" if ratio > 1 + threshold else "  faster" if ratio < 1 - threshold else ""
+        print(f"{name:<45} {a['median']:12.4g} {b['median']:12.4g} {ratio:7.2f}x{flag}")
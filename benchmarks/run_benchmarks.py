@@ -0,0 +1,44 @@
+# %%
+# Benchmark suite of the nowcasting pipeline and the dashboard.
+# Results are written to benchmarks/results/<commit>.json, so runs on different commits can be compared:
+#
+#   python benchmarks/run_benchmarks.py                      # all benchmarks (the DFM fits take a few minutes)
+#   python benchmarks/run_benchmarks.py --suite dashboard
+#   python benchmarks/run_benchmarks.py --quick              # fewer vintages and EM iterations, smaller histories
+#   python benchmarks/run_benchmarks.py --compare 4b9f178 af0994b
+import os
+# Timings with one BLAS thread are more stable across machines and runs
+for var in ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "VECLIB_MAXIMUM_THREADS"]:
+    os.environ.setdefault(var, "1")
+import argparse
+from common import Results, RESULTS_DIR, compare
+
+SUITES = ["load", "model", "dashboard"]
+
+# %%
+def run(suites, quick = False, quarter = None, results_dir = RESULTS_DIR):
+    results = Results()
+    if "load" in suites or "model" in suites:
+        import bench_pipeline
+        if "load" in suites:
+            bench_pipeline.bench_load(results, n = 5 if quick else None)
+        if "model" in suites:
+            bench_pipeline.bench_model(results, quarter = quarter or bench_pipeline.QUARTER, maxiter = 10 if quick else None)
+    if "dashboard" in suites:
+        import bench_dashboard
+        bench_dashboard.bench_callbacks(results, scales = [1, 10] if quick else bench_dashboard.SCALES)
+    return results.write(results_dir)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmark the nowcasting pipeline and the dashboard")
+    parser.add_argument("--suite", nargs = "+", choices = SUITES + ["all"], default = ["all"])
+    parser.add_argument("--quick", action = "store_true", help = "smaller benchmarks, e.g. to check that they run")
+    parser.add_argument("--quarter", help = "quarter of the model benchmarks (default 2023Q2)")
+    parser.add_argument("--results-dir", default = RESULTS_DIR)
+    parser.add_argument("--compare", nargs = 2, metavar = ("BASE", "NEW"),
+                        help = "compare two result files (paths or commits) instead of running")
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+    else:
+        run(SUITES if "all" in args.suite else args.suite, args.quick, args.quarter, args.results_dir)
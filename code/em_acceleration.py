@@ -0,0 +1,177 @@
+# %%
+# Accelerated EM for the DFM: SQUAREM (Varadhan and Roland, 2008) on top of the EM iterations of DynamicFactorMQ.
+# Every EM iteration of DynamicFactorMQ runs a full Kalman smoother, and near the optimum EM creeps along a
+# ridge of the likelihood with tiny steps. SQUAREM takes two EM steps, extrapolates along the direction they
+# agree on, and takes one more EM step from there to stabilize. The extrapolation is kept if the likelihood
+# did not drop below that of plain EM, else the cycle falls back to the plain EM step, so the likelihood
+# never decreases by more than plain EM would allow. As in the EM of statsmodels, the initial state is
+# re-estimated along with the parameters (em_initialization=True), so the results can be stored and
+# warm-started from like those of `fit`.
+#
+# The comparison with the default fit (time, EM iterations, likelihood and nowcasts) for a vintage is
+#   python code/em_acceleration.py --vintage econdata_nowcast_data_06_01_2023.xlsx [--tolerance 1e-5]
+import os
+import json
+import argparse
+import warnings
+import numpy as np
+from datetime import datetime
+from statsmodels.tools.sm_exceptions import ConvergenceWarning
+from statsmodels.tools.tools import Bunch
+from statsmodels.tsa.statespace.initialization import Initialization
+
+EM_METHODS = ["em", "squarem"]
+# Relative llf change at which the accelerated fit stops: coarser than the default of EM (1e-6), see
+# `compare_fits` for what this costs in the nowcasts
+SQUAREM_TOLERANCE = 1e-5
+# Smallest variance an extrapolation may produce
+MIN_VARIANCE = 1e-8
+# Largest extrapolation step (alpha = -1 is a plain EM step)
+MAX_STEP = 64
+
+# %%
+def relative_change(llf1, llf0):
+    # Convergence criterion of the EM of statsmodels
+    return 2 * abs(llf1 - llf0) / (abs(llf1) + abs(llf0))
+
+def em_step(model, params, init):
+    # One EM iteration: the llf at `params`, the next parameters, and the initial state estimated along with them
+    res, new_params = model._em_iteration(params, init=init)
+    new_init = Initialization(model.k_states, "known", constant=res.smoothed_state[..., 0],
+                              stationary_cov=res.smoothed_state_cov[..., 0])
+    return res.llf_obs.sum(), new_params, new_init
+
+def extrapolate(params0, params1, params2, variances):
+    # The SQUAREM step (scheme S3) from three successive EM iterates, with the variances kept positive
+    r = params1 - params0
+    v = params2 - params1 - r
+    norm_v = np.linalg.norm(v)
+    if norm_v == 0:
+        return params2, -1.0
+    alpha = max(-np.linalg.norm(r) / norm_v, -MAX_STEP)
+    if alpha > -1:
+        return params2, -1.0
+    params = params0 - 2 * alpha * r + alpha ** 2 * v
+    params[variances] = np.maximum(params[variances], MIN_VARIANCE)
+    return params, alpha
+
+def fit_squarem(model, start_params = None, maxiter = 500, tolerance = SQUAREM_TOLERANCE, disp = False,
+                llf_decrease_tolerance = 1e-4):
+    # SQUAREM fit of a DynamicFactorMQ model, from its current initialization. Returns results like those of
+    # `model.fit`, with mle_retvals iter counting the EM iterations (Kalman smoother runs) used
+    params = np.array(model.start_params if start_params is None else start_params, dtype=float)
+    variances = np.array([name.startswith("sigma2.") for name in model.param_names])
+    inits = [model.ssm.initialization]
+    init = None
+    llf, steps = [], []
+    iterations = 0
+    converged = False
+    while iterations + 3 <= maxiter:
+        llf0, params1, init1 = em_step(model, params, init)
+        llf1, params2, init2 = em_step(model, params1, init1)
+        iterations += 2
+        llf += [llf0, llf1]
+        if relative_change(llf1, llf0) <= tolerance:
+            # As in `fit`, the results are those of the EM step after the one at which convergence is declared
+            converged = True
+            params, init = params2, init2
+            inits.append(init)
+            break
+        candidate, alpha = extrapolate(params, params1, params2, variances)
+        accepted = False
+        if alpha < -1:
+            # Stabilize with an EM step from the extrapolated parameters (its E-step gives their llf)
+            try:
+                with np.errstate(all="ignore"):
+                    llf2, params3, init3 = em_step(model, candidate, init2)
+                iterations += 1
+                accepted = np.isfinite(llf2) and llf2 >= llf1 - llf_decrease_tolerance
+            except np.linalg.LinAlgError:
+                iterations += 1
+        if accepted:
+            params, init = params3, init3
+        else:  # Fall back to the plain EM step
+            alpha = -1.0
+            params, init = params2, init2
+        steps.append(alpha)
+        inits.append(init)
+        if disp and len(steps) % disp == 0:
+            print(f"SQUAREM cycle {len(steps)} ({iterations} EM iterations), llf={llf[-1]:.5g}, step={alpha:.3g}")
+    if not converged:
+        warnings.warn(f"SQUAREM reached the maximum number of EM iterations ({maxiter}) without converging: " +
+                      f"llf={llf[-1]:.5g}", ConvergenceWarning, stacklevel=2)
+    # Final smoothing pass, as in `fit`, from the parameters and initial state at convergence
+    base_init = model.ssm.initialization
+    if init is not None:
+        model.ssm.initialization = init
+    try:
+        results = model.smooth(params, transformed=True, cov_type="none")
+    finally:
+        model.ssm.initialization = base_init
+    llf.append(results.llf)
+    if disp:
+        print(f"SQUAREM {'converged' if converged else 'stopped'} after {len(steps)} cycles " +
+              f"({iterations} EM iterations), llf={results.llf:.5g}")
+    results._results.mle_retvals = Bunch(params = params, llf = np.array(llf), iter = iterations, inits = inits,
+                                         cycles = len(steps), steps = np.array(steps), converged = converged)
+    results._results.mle_settings = Bunch(method = "squarem", tolerance = tolerance, maxiter = maxiter)
+    return results
+
+# %%
+def nowcast_values(results, quarter):
+    from nowcast_model import NOWCAST_VARIABLES, quarter_month
+    nowcast = results.get_prediction(start = quarter_month(quarter)).predicted_mean[NOWCAST_VARIABLES].iloc[0]
+    return {k: float(v) for k, v in nowcast.items()}
+
+def compare_fits(model, quarter, start = None, tolerance = SQUAREM_TOLERANCE):
+    # Time, EM iterations, llf and nowcast of the default fit and of the accelerated fit of the same model
+    from model_store import fit_warm, em_iterations, Timer
+    report = dict(tolerance = tolerance, warm_start = start is not None, fits = {})
+    for method in EM_METHODS:
+        with Timer() as timer:
+            results = fit_warm(model, start, method = method, **({} if method == "em" else dict(tolerance = tolerance)))
+        report["fits"][method] = dict(seconds = round(timer.seconds, 3), iterations = em_iterations(results),
+                                      llf = float(results.llf), nowcast = nowcast_values(results, quarter))
+    em, fast = report["fits"]["em"], report["fits"]["squarem"]
+    report["speedup"] = em["seconds"] / fast["seconds"]
+    report["llf_difference"] = fast["llf"] - em["llf"]
+    report["nowcast_difference"] = {k: fast["nowcast"][k] - em["nowcast"][k] for k in em["nowcast"]}
+    return report
+
+def print_comparison(report):
+    print(f"{'':<10} {'seconds':>9} {'iterations':>11} {'llf':>14}   " +
+          " ".join(f"{k:>10}" for k in report["nowcast_difference"]))
+    for method, fit in report["fits"].items():
+        print(f"{method:<10} {fit['seconds']:9.1f} {fit['iterations']:11d} {fit['llf']:14.4f}   " +
+              " ".join(f"{v:10.5f}" for v in fit["nowcast"].values()))
+    print(f"{'difference':<10} {report['speedup']:8.2f}x {'':>11} {report['llf_difference']:14.4f}   " +
+          " ".join(f"{v:10.5f}" for v in report["nowcast_difference"].values()))
+
+def main(argv = None):
+    import pandas as pd
+    from nowcast_model import CACHE_DIR, load_vintage, vintage_date, dfm_model
+    from model_store import PARAMS_DIR, load_params
+    from run_report import REPORT_DIR
+    parser = argparse.ArgumentParser(description = "Compare the accelerated EM fit of the DFM with the default fit")
+    parser.add_argument("--vintage", required = True, help = "vintage workbook (file name in --vintage-dir)")
+    parser.add_argument("--vintage-dir", default = "vintages")
+    parser.add_argument("--tolerance", type = float, default = SQUAREM_TOLERANCE)
+    parser.add_argument("--warm", action = "store_true", help = "start both fits from the stored estimates")
+    parser.add_argument("--report-dir", default = REPORT_DIR)
+    args = parser.parse_args(argv)
+    quarter = pd.Period(vintage_date(args.vintage), freq="Q")
+    model = dfm_model(load_vintage(os.path.join(args.vintage_dir, args.vintage), CACHE_DIR))
+    start = load_params(PARAMS_DIR, quarter, args.vintage, model) if args.warm else None
+    if args.warm and start is None:
+        parser.error(f"No stored estimates for {args.vintage} in {PARAMS_DIR}")
+    report = dict(vintage = args.vintage, quarter = str(quarter), **compare_fits(model, quarter, start, args.tolerance))
+    print_comparison(report)
+    os.makedirs(args.report_dir, exist_ok=True)
+    path = os.path.join(args.report_dir, f"em-{os.path.splitext(args.vintage)[0]}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(path, "w") as f:
+        json.dump(report, f, indent=1)
+    print("Wrote", path)
+    return report
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+# %%
+# Ingestion service: watches the vintage directory and runs the nowcast for every new vintage, instead of the
+# weekly run being started by hand or by an outside scheduler.
+#   - The directory is polled. A burst of new or changed workbooks is handled as one batch once the directory
+#     has been quiet for the debounce period, so files still being written are not read.
+#   - Each workbook of a batch is validated and converted into the vintage cache in a background thread
+#     (sheets, series metadata, sorted dates, and the same series as the first vintage of its quarter).
+#   - Pipeline runs are queued per quarter and run in worker processes, one run at a time per quarter (the
+#     runs also hold the quarter's lock, see model_store.quarter_lock). Dates that arrive while their
+#     quarter is running are queued for the next run of the quarter. A failed run is retried with its dates
+#     after a delay that doubles with every failure, up to a number of attempts; then the failure is final.
+#   - When a run completes, the csv files are exported and the dashboard artifact is rebuilt (the dashboard
+#     reloads it, see app/data_store.py), and the completion is appended to the event log.
+# With --inbox, workbooks are dropped into another directory (e.g. by the EconData/SAMADB export) and only
+# valid ones are moved into the vintage directory.
+#
+#   python code/ingest_service.py                          # watch vintages/, as a long-running service
+#   python code/ingest_service.py --once --catch-up        # run for the vintages missing from the nowcast and exit
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import traceback
+import subprocess
+import pandas as pd
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from nowcast_model import CACHE_DIR, NOWCAST_VARIABLES, START, Vintage, is_vintage, list_vintages, vintage_date
+from nowcast_pipeline import run_dates
+from nowcast_store import read_partition, export_csv
+from vintage_cache import file_hash
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATE_DIR = "cache/ingest"
+# Seconds between scans of the directory, and of quiet before a batch of new workbooks is ingested
+POLL_INTERVAL = 30
+DEBOUNCE = 60
+# Runs of a quarter per batch of dates (the first run and its retries), and seconds before the first retry
+# (doubled for each later one)
+MAX_ATTEMPTS = 4
+RETRY_DELAY = 300
+SERIES_COLUMNS = ["series", "freq", "broad_sector"]
+
+# %%
+def validate_vintage(path, cache_dir = CACHE_DIR, reference = None):
+    # Converts a workbook into the vintage cache and checks that the model can use it; raises ValueError if
+    # not. reference: a vintage with the series the model of the quarter was specified on
+    try:
+        data = Vintage(path, cache_dir)
+        series, monthly, quarterly = data["series"], data["data_logdiff"], data["gdp_logdiff"]
+    except Exception as e:  # Unreadable workbook or missing sheet
+        raise ValueError(f"cannot read {os.path.basename(path)}: {e}")
+    missing = [c for c in SERIES_COLUMNS if c not in series.columns]
+    if missing:
+        raise ValueError(f"series sheet has no column(s) {missing}")
+    if list(data["series_m"].series) != list(monthly.columns):
+        raise ValueError("the monthly series of the series sheet and of data_logdiff_m differ")
+    missing = [v for v in NOWCAST_VARIABLES if v not in quarterly.columns]
+    if missing:
+        raise ValueError(f"data_logdiff_q has no column(s) {missing}")
+    for name, df in [("data_logdiff_m", monthly), ("data_logdiff_q", quarterly)]:
+        if len(df) == 0:
+            raise ValueError(f"{name} has no data from {START}")
+        if not df.index.is_monotonic_increasing or df.index.has_duplicates:
+            raise ValueError(f"the dates of {name} are not sorted or not unique")
+    if reference is not None and list(reference["data_logdiff"].columns) != list(monthly.columns):
+        raise ValueError("the monthly series differ from those of the first vintage of the quarter")
+
+def quarter_of(vintage):
+    return pd.Period(vintage_date(vintage), freq="Q")
+
+# %%
+class IngestService:
+    def __init__(self, vintage_dir = "vintages", output_dir = "nowcast", inbox = None, cache_dir = CACHE_DIR,
+                 state_dir = STATE_DIR, artifact_dir = os.path.join(ROOT, "app", "data"), interval = POLL_INTERVAL,
+                 debounce = DEBOUNCE, workers = 1, catch_up = False, max_attempts = MAX_ATTEMPTS,
+                 retry_delay = RETRY_DELAY, **run_kwargs):
+        # artifact_dir: dashboard data rebuilt after each run (None to skip). run_kwargs: passed to the pipelines
+        self.vintage_dir = vintage_dir
+        self.output_dir = output_dir
+        self.inbox = inbox
+        self.watch_dir = vintage_dir if inbox is None else inbox
+        self.cache_dir = cache_dir
+        self.state_dir = state_dir
+        self.artifact_dir = artifact_dir
+        self.interval = interval
+        self.debounce = debounce
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.run_kwargs = dict(run_kwargs, vintage_dir = vintage_dir, output_dir = output_dir, cache_dir = cache_dir)
+        os.makedirs(state_dir, exist_ok=True)
+        self.state_path = os.path.join(state_dir, "state.json")
+        self.events_path = os.path.join(state_dir, "events.jsonl")
+        # Ingested workbooks: name -> {hash, status, error}
+        self.state = self.read_state(catch_up)
+        self.files = {}  # name -> (size, mtime) at the last scan
+        self.changed = {}  # name -> time seen new or changed, not yet ingested
+        self.last_change = 0.0
+        self.validation = None  # future of the batch being validated
+        self.pending = {}  # quarter -> dates waiting for a run
+        self.running = {}  # quarter -> (future, dates, start time)
+        self.failures = {}  # quarter -> failed runs in a row
+        self.retries = {}  # quarter -> (dates of the failed run, time of the retry)
+        self.validator = ThreadPoolExecutor(1, thread_name_prefix = "ingest")
+        self.runner = ProcessPoolExecutor(workers)
+
+    # %%
+    def read_state(self, catch_up):
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                return json.load(f)
+        # First start: the vintages already there are taken as ingested, unless catching up, in which case those
+        # without a nowcast in the store are ingested
+        state = {}
+        store_dir = os.path.join(self.output_dir, "store")
+        dates = {}
+        for vintage in list_vintages(self.vintage_dir):
+            if catch_up:
+                quarter = quarter_of(vintage)
+                if quarter not in dates:
+                    nowcast = read_partition(store_dir, "nowcast", quarter)
+                    dates[quarter] = set() if nowcast is None else set(nowcast.date)
+                if str(vintage_date(vintage).date()) not in dates[quarter]:
+                    continue
+            state[vintage] = dict(hash = file_hash(os.path.join(self.vintage_dir, vintage)), status = "existing")
+        self.write_state(state)
+        return state
+
+    def write_state(self, state = None):
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.state if state is None else state, f, indent = 1)
+        os.replace(tmp, self.state_path)
+
+    def event(self, event, **info):
+        # Appends to the event log (one JSON object per line), which is also printed
+        record = dict(time = datetime.now().isoformat(timespec = "seconds"), event = event, **info)
+        with open(self.events_path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+        print(json.dumps(record), flush = True)
+
+    # %%
+    def scan(self):
+        # Notes new and changed workbooks, and when the directory last changed
+        now = time.monotonic()
+        files = {}
+        for name in os.listdir(self.watch_dir):
+            if is_vintage(name):
+                st = os.stat(os.path.join(self.watch_dir, name))
+                files[name] = (st.st_size, st.st_mtime_ns)
+        for name, stat in files.items():
+            if self.files.get(name) != stat:
+                self.last_change = now
+                self.changed[name] = now
+        self.files = files
+        for name in list(self.changed):
+            if name not in files:
+                del self.changed[name]
+
+    def ingest(self, names):
+        # Background thread: validates and converts the workbooks of a batch, moving valid ones from the inbox.
+        # Returns {name: (hash, error or None)}
+        results = {}
+        for name in sorted(names, key = vintage_date):
+            path = os.path.join(self.watch_dir, name)
+            try:
+                digest = file_hash(path)
+                if self.state.get(name, {}).get("hash") == digest:
+                    continue  # Touched but not changed
+                vintages = [v for v in list_vintages(self.vintage_dir) if quarter_of(v) == quarter_of(name)]
+                first = vintages[0] if vintages and vintage_date(vintages[0]) < vintage_date(name) else None
+                reference = None if first is None else Vintage(os.path.join(self.vintage_dir, first), self.cache_dir)
+                validate_vintage(path, self.cache_dir, reference)
+                if self.inbox is not None:
+                    tmp = os.path.join(self.vintage_dir, "." + name)
+                    shutil.copy2(path, tmp)
+                    os.replace(tmp, os.path.join(self.vintage_dir, name))
+                    os.remove(path)
+                results[name] = (digest, None)
+            except Exception as e:
+                results[name] = (None if not os.path.exists(path) else file_hash(path), str(e))
+        return results
+
+    def collect_ingested(self):
+        if self.validation is None or not self.validation.done():
+            return
+        results, self.validation = self.validation.result(), None
+        for name, (digest, error) in results.items():
+            self.state[name] = dict(hash = digest, status = "invalid" if error else "ingested", error = error)
+            if error:
+                self.event("invalid", vintage = name, error = error)
+            else:
+                self.event("ingested", vintage = name)
+                date = vintage_date(name)
+                self.pending.setdefault(str(pd.Period(date, freq="Q")), set()).add(str(date.date()))
+        self.write_state()
+
+    # %%
+    def start_runs(self):
+        now = time.monotonic()
+        for quarter, (dates, due) in list(self.retries.items()):
+            if due <= now:
+                del self.retries[quarter]
+                self.pending.setdefault(quarter, set()).update(dates)
+        for quarter in list(self.pending):
+            if quarter not in self.running:
+                # New dates of a quarter waiting for a retry are run together with the failed ones
+                dates = sorted(self.pending.pop(quarter) | self.retries.pop(quarter, (set(), None))[0])
+                future = self.runner.submit(run_dates, dates, **self.run_kwargs)
+                self.running[quarter] = (future, dates, time.monotonic())
+                self.event("run_started", quarter = quarter, dates = dates)
+
+    def collect_runs(self):
+        finished = [q for q, (future, _, _) in self.running.items() if future.done()]
+        for quarter in finished:
+            future, dates, start = self.running.pop(quarter)
+            seconds = round(time.monotonic() - start, 1)
+            try:
+                future.result()
+            except Exception:
+                self.failed(quarter, dates, seconds, traceback.format_exc(limit = 3))
+                continue
+            self.failures.pop(quarter, None)
+            self.event("run_finished", quarter = quarter, dates = dates, seconds = seconds)
+            self.publish(quarter, dates)
+
+    def failed(self, quarter, dates, seconds, error):
+        # Queues the dates of a failed run for a retry, with a backoff, unless it was the last attempt
+        failures = self.failures[quarter] = self.failures.get(quarter, 0) + 1
+        if failures >= self.max_attempts:
+            del self.failures[quarter]
+            self.event("run_failed", quarter = quarter, dates = dates, seconds = seconds, attempts = failures,
+                       error = error)
+            return
+        delay = self.retry_delay * 2 ** (failures - 1)
+        self.retries[quarter] = (set(dates), time.monotonic() + delay)
+        self.event("run_failed", quarter = quarter, dates = dates, seconds = seconds, attempts = failures,
+                   retry_in = delay, error = error)
+
+    def publish(self, quarter, dates):
+        # The outputs of a completed run: the csv files, then the dashboard data
+        try:
+            export_csv(os.path.join(self.output_dir, "store"), self.output_dir)
+            if self.artifact_dir is not None:
+                subprocess.run([sys.executable, os.path.join(ROOT, "app", "data_source.py"),
+                                "--nowcast-dir", self.output_dir, "--out-dir", self.artifact_dir], check = True)
+        except Exception as e:
+            self.event("publish_failed", quarter = quarter, dates = dates, error = str(e))
+            return
+        self.event("published", quarter = quarter, dates = dates, output_dir = self.output_dir,
+                   artifact_dir = self.artifact_dir)
+
+    # %%
+    def step(self):
+        # One round of the service loop; returns True if there is nothing left to do
+        self.collect_runs()
+        self.collect_ingested()
+        self.scan()
+        # All workbooks are seen as new at the first scan: those ingested before are skipped by their hash
+        quiet = time.monotonic() - self.last_change >= self.debounce
+        if self.changed and quiet and self.validation is None:
+            names, self.changed = list(self.changed), {}
+            self.validation = self.validator.submit(self.ingest, names)
+        self.start_runs()
+        return not (self.changed or self.validation or self.pending or self.running or self.retries)
+
+    def run_forever(self, once = False):
+        self.event("started", watch_dir = self.watch_dir, vintage_dir = self.vintage_dir, debounce = self.debounce)
+        try:
+            while True:
+                idle = self.step()
+                if once and idle:
+                    break
+                time.sleep(self.interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.validator.shutdown(wait = True)
+            self.runner.shutdown(wait = True, cancel_futures = True)
+            self.write_state()
+            self.event("stopped")
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Watch the vintage directory and run the nowcast for new vintages")
+    parser.add_argument("--vintage-dir", default = "vintages")
+    parser.add_argument("--output-dir", default = "nowcast")
+    parser.add_argument("--inbox", help = "directory new workbooks are dropped into (default: the vintage directory)")
+    parser.add_argument("--state-dir", default = STATE_DIR)
+    parser.add_argument("--artifact-dir", default = os.path.join(ROOT, "app", "data"),
+                        help = "dashboard data to rebuild after each run ('' to skip)")
+    parser.add_argument("--interval", type = float, default = POLL_INTERVAL, help = "seconds between scans")
+    parser.add_argument("--debounce", type = float, default = DEBOUNCE, help = "seconds of quiet before ingesting")
+    parser.add_argument("--workers", type = int, default = 1, help = "processes for runs in different quarters")
+    parser.add_argument("--max-attempts", type = int, default = MAX_ATTEMPTS,
+                        help = "runs of a quarter before a failure is final (1: no retries)")
+    parser.add_argument("--retry-delay", type = float, default = RETRY_DELAY,
+                        help = "seconds before the first retry of a failed run, doubled for each later one")
+    parser.add_argument("--catch-up", action = "store_true",
+                        help = "on first start, also ingest the vintages that have no nowcast in the store")
+    parser.add_argument("--once", action = "store_true", help = "exit when there is nothing left to do")
+    args = parser.parse_args(argv)
+    IngestService(args.vintage_dir, args.output_dir, args.inbox, state_dir = args.state_dir,
+                  artifact_dir = args.artifact_dir or None, interval = args.interval, debounce = args.debounce,
+                  workers = args.workers, catch_up = args.catch_up, max_attempts = args.max_attempts,
+                  retry_delay = args.retry_delay).run_forever(args.once)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# %%
+# Registry of fitted DFM results per quarter and vintage, restored on demand from the parameter store.
+# A results object of the DFM takes ~340MB (mostly the state covariances of the filter and smoother), so only
+# a few fit in memory, while the news of any pair of vintages and get_prediction need the full smoother output
+# of the results involved. The file of a vintage in the parameter store (model_store.save_params) keeps what
+# rebuilds them exactly: the estimated parameters and the initial state EM estimated along with them, the
+# standardization of the quarter, the model specification and the model data. Restoring is one smoothing pass
+# (~1s), without the vintage workbook or its cache.
+# Results are restored on first access and kept in memory up to `max_results`; beyond that the least recently
+# used are released.
+#
+#   python code/model_registry.py                                  # vintages in the registry
+#   python code/model_registry.py --quarter 2023Q2 --news econdata_nowcast_data_14_04_2023.xlsx \
+#       econdata_nowcast_data_28_04_2023.xlsx                      # news between two stored vintages
+import os
+import argparse
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from nowcast_model import NEWS_COLUMNS, is_vintage, vintage_date, compute_news, news_frame
+from model_store import PARAMS_DIR, params_path, load_params, load_model, restore_results
+
+# Results kept in memory by a registry (~340MB each): a pair of vintages for the news
+MAX_RESULTS = 2
+
+# %%
+class ModelRegistry:
+    def __init__(self, store_dir = PARAMS_DIR, max_results = MAX_RESULTS):
+        self.store_dir = store_dir
+        self.max_results = max_results
+        # (quarter, vintage) -> results, least recently used first
+        self.results = OrderedDict()
+
+    def key(self, quarter, vintage):
+        return str(quarter), os.path.basename(vintage)
+
+    def vintages(self, quarter):
+        # Vintages of the quarter with stored estimates, in date order
+        directory = os.path.join(self.store_dir, str(quarter))
+        if not os.path.isdir(directory):
+            return []
+        names = [name[:-len(".npz")] + ".xlsx" for name in os.listdir(directory) if name.endswith(".npz")]
+        return sorted((name for name in names if is_vintage(name)), key = vintage_date)
+
+    def add(self, quarter, vintage, results):
+        key = self.key(quarter, vintage)
+        self.results[key] = results
+        self.results.move_to_end(key)
+        while len(self.results) > self.max_results:
+            self.results.popitem(last = False)
+
+    def get(self, quarter, vintage):
+        # The results of a vintage, restored from the parameter store if they are not in memory (None if the
+        # store has no estimates for it, or none with the model data)
+        key = self.key(quarter, vintage)
+        if key in self.results:
+            self.results.move_to_end(key)
+            return self.results[key]
+        model = load_model(self.store_dir, quarter, vintage)
+        if model is None:
+            return None
+        stored = load_params(self.store_dir, quarter, vintage, model)
+        if stored is None:
+            raise ValueError(f"{params_path(self.store_dir, quarter, vintage)}: the stored parameters do not " +
+                             "match the stored model")
+        results = restore_results(model, stored)
+        self.add(quarter, vintage, results)
+        return results
+
+    def evict(self, quarter, vintage):
+        self.results.pop(self.key(quarter, vintage), None)
+
+    def clear(self):
+        self.results.clear()
+
+# %%
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Fitted DFM results per quarter and vintage")
+    parser.add_argument("--store-dir", default = PARAMS_DIR)
+    parser.add_argument("--quarter", help = "only this quarter (e.g. 2023Q2)")
+    parser.add_argument("--news", nargs = 2, metavar = ("PREVIOUS", "VINTAGE"),
+                        help = "news of VINTAGE relative to PREVIOUS, from their stored estimates in --quarter")
+    args = parser.parse_args(argv)
+    registry = ModelRegistry(args.store_dir)
+    if args.news:
+        if args.quarter is None:
+            parser.error("--news needs --quarter")
+        quarter = pd.Period(args.quarter, freq="Q")
+        previous, vintage = args.news
+        results = [registry.get(quarter, v) for v in (vintage, previous)]
+        missing = [v for v, r in zip((vintage, previous), results) if r is None]
+        if missing:
+            parser.error(f"No stored estimates with the model data for {', '.join(missing)} in {args.store_dir}")
+        news = news_frame(compute_news(results[0], results[1], quarter), vintage_date(vintage).date(), quarter)
+        print(news[NEWS_COLUMNS[3:]].to_string(index = False))
+        return news
+    quarters = [args.quarter] if args.quarter else \
+        sorted(q for q in os.listdir(args.store_dir) if os.path.isdir(os.path.join(args.store_dir, q))) \
+        if os.path.isdir(args.store_dir) else []
+    for quarter in quarters:
+        for vintage in registry.vintages(quarter):
+            path = params_path(args.store_dir, quarter, vintage)
+            with np.load(path) as f:
+                llf = f"llf={float(f['llf']):.2f}" if "llf" in f else "no model data"
+            print(f"{quarter}  {vintage}  {llf}  {os.path.getsize(path) / 1e3:.0f}KB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+# %%
+# Store of fitted DFM parameters, used to warm-start EM in later runs.
+# For every quarter and vintage we keep the estimated parameter vector, the initial state that EM estimated
+# along with it (em_initialization), and the standardization (means and scale factors of the first vintage
+# of the quarter) that the parameters refer to. Restarting EM from the parameters alone is not enough: with
+# the default initialization the likelihood drops and EM needs nearly as many iterations as from a cold
+# start. With both, a fit on the same vintage converges within a couple of iterations, and refits on newer
+# vintages start from the closest older vintage instead of from the first vintage of the quarter.
+# The file (compressed, ~200KB) also keeps the model specification and the model data, so that the results
+# can be rebuilt without the vintage workbook (`load_model` and `restore_results`, see model_registry.py).
+import os
+import csv
+import json
+import time
+import tempfile
+import contextlib
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from statsmodels.tsa.api import DynamicFactorMQ
+from statsmodels.tsa.statespace.initialization import Initialization
+from em_acceleration import EM_METHODS, em_step, fit_squarem
+try:
+    import fcntl
+except ImportError:  # Windows: no locking between processes
+    fcntl = None
+
+PARAMS_DIR = "cache/dfm"
+# Added to the covariance of a stored initial state before warm-starting EM from it (see `fit_warm`)
+INIT_COV_JITTER = 1e-6
+FIT_LOG_FIELDS = ["run", "quarter", "vintage", "stage", "warm_start", "iterations", "llf", "seconds"]
+
+# %%
+def params_path(store_dir, quarter, vintage):
+    return os.path.join(store_dir, str(quarter), os.path.splitext(os.path.basename(vintage))[0] + ".npz")
+
+def em_initialization(results):
+    # The known initial state EM ended with (None if the results did not come from EM)
+    retvals = getattr(results, "mle_retvals", None)
+    if retvals is None or "inits" not in retvals or len(retvals["inits"]) == 0:
+        return None
+    init = retvals["inits"][-1]
+    return init if init.initialization_type == "known" else None
+
+def warm_start(results):
+    # The (parameters, initialization) pair of EM results, or the pair that restored results were built from
+    restored_from = getattr(results, "restored_from", None)
+    return (results.params, em_initialization(results)) if restored_from is None else restored_from
+
+def save_params(store_dir, quarter, vintage, results):
+    path = params_path(store_dir, quarter, vintage)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    model = results.model
+    params, init = warm_start(results)
+    endog = model.data.orig_endog
+    spec = {k: v for k, v in model._get_init_kwds().items() if k != "standardize"}
+    extra = {} if init is None else dict(init_constant = init.constant, init_cov = init.stationary_cov)
+    fd, tmp = tempfile.mkstemp(prefix=".tmp-", suffix=".npz", dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez_compressed(f, params = np.asarray(params), param_names = np.array(model.param_names),
+                                endog_names = np.array(model.endog_names),
+                                endog_mean = np.asarray(model._endog_mean, dtype=float),
+                                endog_std = np.asarray(model._endog_std, dtype=float),
+                                endog = endog.to_numpy(dtype=float),
+                                endog_index = np.array(endog.index.astype(str), dtype=str),
+                                k_endog_monthly = model.k_endog_M, spec = json.dumps(spec),
+                                llf = float(results.llf), **extra)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return path
+
+def load_params(store_dir, quarter, vintage, model = None):
+    # Returns the stored (parameters, initialization) pair, or None. If a model is given, they are only
+    # returned if they were estimated for a model with the same parameters and variables.
+    path = params_path(store_dir, quarter, vintage)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as f:
+        if model is not None and (list(f["param_names"]) != list(model.param_names) or
+                                  list(f["endog_names"]) != list(model.endog_names)):
+            return None
+        init = None
+        if "init_constant" in f:
+            init = Initialization(len(f["init_constant"]), "known", constant = f["init_constant"],
+                                  stationary_cov = f["init_cov"])
+        return f["params"].copy(), init
+
+def load_model(store_dir, quarter, vintage):
+    # The model the stored parameters were estimated for, rebuilt from the model data, specification and
+    # standardization in the file (None if there is no file, or it was written before they were stored)
+    path = params_path(store_dir, quarter, vintage)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as f:
+        if "endog" not in f:
+            return None
+        names = list(f["endog_names"])
+        endog = pd.DataFrame(f["endog"], index = pd.PeriodIndex(f["endog_index"], freq="M", name="date"),
+                             columns = names)
+        return DynamicFactorMQ(endog, k_endog_monthly = int(f["k_endog_monthly"]),
+                               standardize = (pd.Series(f["endog_mean"], index=names),
+                                              pd.Series(f["endog_std"], index=names)),
+                               **json.loads(str(f["spec"])))
+
+def stored_data_match(store_dir, quarter, vintage, model):
+    # Whether the stored estimates of a vintage were made on the same model data, with the same standardization
+    # and specification as `model`: the stored results can then be restored instead of refitted
+    path = params_path(store_dir, quarter, vintage)
+    if not os.path.exists(path):
+        return False
+    endog = model.data.orig_endog
+    spec = {k: v for k, v in model._get_init_kwds().items() if k != "standardize"}
+    with np.load(path) as f:
+        if "endog" not in f or json.loads(str(f["spec"])) != json.loads(json.dumps(spec)):
+            return False
+        return (list(f["endog_names"]) == list(model.endog_names) and int(f["k_endog_monthly"]) == model.k_endog_M and
+                list(f["endog_index"]) == list(endog.index.astype(str)) and
+                np.array_equal(f["endog"], endog.to_numpy(dtype=float), equal_nan=True) and
+                np.array_equal(f["endog_mean"], np.asarray(model._endog_mean, dtype=float)) and
+                np.array_equal(f["endog_std"], np.asarray(model._endog_std, dtype=float)))
+
+@contextlib.contextmanager
+def quarter_lock(store_dir, quarter):
+    # Exclusive lock on the estimates of a quarter, held by a nowcast run from its fit to its outputs, so that
+    # two runs (e.g. the ingestion service and a manual run) never fit the same quarter at once
+    path = os.path.join(store_dir, str(quarter), ".lock")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+def fit_warm(model, start = None, method = "em", **kwargs):
+    # EM fit starting from a (parameters, initialization) pair, e.g. from `load_params` or `warm_start`.
+    # The covariance of the stored initial state is numerically singular. When the first observations were
+    # revised (e.g. by the seasonal adjustment), the new data then have zero variance under it and the
+    # likelihood collapses after the first M-step, so a small jitter is added. With the jitter the first
+    # iteration can have a higher likelihood than the ones that follow with EM's own initialization; this is
+    # not a real decrease, so the first EM step is run on its own and EM continues from the initial state it
+    # estimated, with the usual checks on the likelihood.
+    # method "squarem" runs the accelerated EM of em_acceleration.py instead of the EM of statsmodels.
+    if method not in EM_METHODS:
+        raise ValueError(f"Unknown EM method {method!r}, expected one of {EM_METHODS}")
+    fit = model.fit if method == "em" else lambda **kw: fit_squarem(model, **kw)
+    params, init = (None, None) if start is None else start
+    if init is None:
+        return fit(start_params=params, **kwargs)
+    model.ssm.initialization = Initialization(model.k_states, "known", constant = init.constant,
+        stationary_cov = init.stationary_cov + INIT_COV_JITTER * np.eye(model.k_states))
+    try:
+        if method != "em":
+            return fit(start_params=params, **kwargs)
+        _, params, model.ssm.initialization = em_step(model, params, None)
+        kwargs["maxiter"] = kwargs.get("maxiter", 500) - 1
+        results = fit(start_params=params, **kwargs)
+        results.mle_retvals.iter += 1
+        return results
+    finally:
+        model.ssm.initialize(model._default_initialization())
+
+def restore_results(model, start):
+    # Results of an EM fit rebuilt from its (parameters, initialization) pair without running EM: the same
+    # final smoothing pass that `fit` ends with
+    params, init = start
+    if init is None:
+        results = model.smooth(params)
+    else:
+        model.ssm.initialization = init
+        try:
+            results = model.smooth(params)
+        finally:
+            model.ssm.initialize(model._default_initialization())
+    results.restored_from = (params, init)
+    return results
+
+# %%
+def em_iterations(results):
+    retvals = getattr(results, "mle_retvals", None)
+    return None if retvals is None else int(retvals["iter"])
+
+def log_fit(store_dir, quarter, vintage, stage, results, seconds, warm, iterations = None):
+    # Append one line per EM run to the fit log, so warm and cold starts can be compared across runs
+    path = os.path.join(store_dir, "fit_log.csv")
+    os.makedirs(store_dir, exist_ok=True)
+    new = not os.path.exists(path)
+    row = dict(run = datetime.now().isoformat(timespec="seconds"), quarter = str(quarter),
+               vintage = os.path.basename(vintage), stage = stage, warm_start = warm,
+               iterations = em_iterations(results) if iterations is None else iterations,
+               llf = float(results.llf), seconds = round(seconds, 3))
+    with open(path, "a", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=FIT_LOG_FIELDS)
+        if new:
+            writer.writeheader()
+        writer.writerow(row)
+    print(f"{stage} on {row['vintage']}: {row['iterations']} EM iterations in {row['seconds']}s " +
+          f"({'from stored estimates' if warm else 'no stored estimates'}, llf={row['llf']:.2f})")
+    return row
+
+# %%
+class Timer:
+    # Wall-clock timer usable as a context manager: `with Timer() as t: ...; t.seconds`
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self.start
+        return False
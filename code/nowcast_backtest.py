@@ -0,0 +1,212 @@
+# %%
+# Backtest of the nowcasting model over all vintages in the vintage directory.
+# Vintages are grouped by quarter. The DFM is fitted on the first vintage of each quarter, and every other
+# vintage is refitted once from those estimates with the first vintage's standardization, exactly as the serial
+# weekly script did (`results.apply(..., refit=True)`: EM from the first vintage's parameters, with the default
+# initialization), so the backtest reproduces the published nowcasts.
+# Each vintage then gives a nowcast and the news relative to the preceding vintage: the news are computed in a
+# second pass from the estimates of both refits (one smoothing pass each, no EM). Quarter fits, per-vintage
+# refits and news run on a process pool: a quarter's vintages are submitted as soon as its fit is done, and
+# the news once all refits are. All results are merged into the nowcast and news csv files in one go.
+# Every task is a deterministic function of the vintage files (stored estimates of the weekly run are not
+# used), so the results do not depend on the number of workers.
+# A worker holds up to two DFM results (~2.5GB at its peak), so the default number of workers is bounded by
+# the available memory as well as by the cores.
+#
+#   python code/nowcast_backtest.py --workers 2 --start 2023-04-01
+import os
+# The pool provides the parallelism: one BLAS thread per process (also keeps results bit-identical)
+for var in ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "VECLIB_MAXIMUM_THREADS"]:
+    os.environ.setdefault(var, "1")
+import argparse
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, Future
+from statsmodels.tsa.statespace.initialization import Initialization
+from nowcast_model import (load_vintage, list_vintages, vintage_date, dfm_model, refit_model,
+                           nowcast_frame, compute_news, news_frame)
+from model_store import em_initialization, restore_results, Timer
+from nowcast_store import ensure_store, append_table, export_csv
+
+# Peak memory of a worker (bytes), used to bound the default number of workers
+WORKER_MEMORY = 2.5e9
+
+# %%
+def backtest_plan(vintage_dir = "vintages", start = None, end = None):
+    # {quarter: [(vintage, previous vintage), ...]} for the vintages dated within [start, end], in date order.
+    # The previous vintage of the first vintage in a quarter is the last vintage of the preceding quarter.
+    vintages = list_vintages(vintage_dir)
+    plan = {}
+    for i, vintage in enumerate(vintages):
+        date = vintage_date(vintage)
+        if (start is not None and date < pd.Timestamp(start)) or (end is not None and date > pd.Timestamp(end)):
+            continue
+        quarter = pd.Period(date, freq="Q")
+        plan.setdefault(quarter, []).append((vintage, vintages[i-1] if i > 0 else None))
+    return plan
+
+def first_vintages(vintage_dir, plan):
+    # The first vintage of each quarter in the directory (which may precede the start of the backtest)
+    firsts = {}
+    for vintage in list_vintages(vintage_dir):
+        firsts.setdefault(pd.Period(vintage_date(vintage), freq="Q"), vintage)
+    return {quarter: firsts[quarter] for quarter in plan}
+
+# %%
+# Estimates are passed between processes as arrays
+def pack_start(params, init):
+    return (np.asarray(params), None if init is None else (init.constant, init.stationary_cov))
+
+def unpack_start(packed):
+    params, init = packed
+    if init is None:
+        return params, None
+    return params, Initialization(len(init[0]), "known", constant = init[0], stationary_cov = init[1])
+
+def vintage_outputs(vintage, quarter, results, previous_results):
+    date = vintage_date(vintage).date()
+    nowcast = nowcast_frame(results, date, quarter)
+    news = None if previous_results is None else news_frame(compute_news(results, previous_results, quarter), date, quarter)
+    return nowcast, news
+
+def refit(dfm_first, data, params):
+    # The refit of `results.apply(endog, endog_quarterly, refit=True, retain_standardization=True)`
+    return refit_model(dfm_first, data).fit(start_params = params)
+
+def fit_quarter(vintage_dir, quarter, first, previous, cache_dir):
+    # Fits the DFM on the first vintage of the quarter. Returns its estimates, and the nowcast and news of the
+    # first vintage if it is part of the backtest (previous is False if it is not)
+    with Timer() as timer:
+        first_data = load_vintage(os.path.join(vintage_dir, first), cache_dir)
+        dfm_first = dfm_model(first_data)
+        results = dfm_first.fit()
+        start = (results.params, em_initialization(results))
+        nowcast = news = None
+        if previous is not False:
+            previous_results = None if previous is None else \
+                refit(dfm_first, load_vintage(os.path.join(vintage_dir, previous), cache_dir), results.params)
+            nowcast, news = vintage_outputs(first, quarter, results, previous_results)
+    print(f"{quarter}: fitted {first} in {results.mle_retvals['iter']} EM iterations ({timer.seconds:.1f}s)", flush=True)
+    return pack_start(*start), nowcast, news
+
+def refit_vintage(vintage_dir, quarter, first, vintage, packed_start, cache_dir, outputs = True):
+    # Refits the DFM on a later vintage of the quarter from the estimates on the first vintage. Returns its
+    # estimates and, if outputs, its nowcast. Every vintage is refitted from the same estimates, so they are
+    # the same whether the vintage is used as the latest or as the previous vintage.
+    with Timer() as timer:
+        dfm_first = dfm_model(load_vintage(os.path.join(vintage_dir, first), cache_dir))
+        results = refit(dfm_first, load_vintage(os.path.join(vintage_dir, vintage), cache_dir), packed_start[0])
+        nowcast = nowcast_frame(results, vintage_date(vintage).date(), quarter) if outputs else None
+    print(f"{quarter}: refitted {vintage} ({timer.seconds:.1f}s)", flush=True)
+    return pack_start(results.params, em_initialization(results)), nowcast
+
+def vintage_news(vintage_dir, quarter, first, vintage, previous, packed_vintage, packed_previous, cache_dir):
+    # The news of a vintage relative to the previous vintage of the quarter, from the estimates of both
+    # (restored with one smoothing pass each)
+    dfm_first = dfm_model(load_vintage(os.path.join(vintage_dir, first), cache_dir))
+    def restore(v, packed):
+        dfm = dfm_first if v == first else refit_model(dfm_first, load_vintage(os.path.join(vintage_dir, v), cache_dir))
+        return restore_results(dfm, unpack_start(packed))
+    results = restore(vintage, packed_vintage)
+    return news_frame(compute_news(results, restore(previous, packed_previous), quarter), vintage_date(vintage).date(), quarter)
+
+# %%
+class SerialExecutor:
+    # Runs tasks immediately in this process (workers = 1), with the interface of ProcessPoolExecutor
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+def default_workers(worker_memory = WORKER_MEMORY):
+    # As many workers as there are cores, and as fit in the available memory
+    cpus = os.cpu_count() or 1
+    try:
+        with open("/proc/meminfo") as f:
+            available = next(int(line.split()[1]) * 1024 for line in f if line.startswith("MemAvailable:"))
+    except (OSError, StopIteration, ValueError):
+        try:
+            available = os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+        except (AttributeError, ValueError, OSError):
+            return cpus
+    return max(1, min(cpus, int(available // worker_memory)))
+
+def run_backtest(vintage_dir = "vintages", start = None, end = None, workers = None, cache_dir = "cache/vintages"):
+    # Returns the nowcast and news frames for all vintages in [start, end]
+    plan = backtest_plan(vintage_dir, start, end)
+    firsts = first_vintages(vintage_dir, plan)
+    workers = default_workers() if workers is None else workers
+    nowcasts, news = [], []
+    with (SerialExecutor() if workers == 1 else ProcessPoolExecutor(max_workers = workers)) as pool:
+        # Quarter fits first, the refits of each quarter as soon as its fit is done
+        fits = {}
+        for quarter, vintages in plan.items():
+            first = firsts[quarter]
+            previous = dict(vintages).get(first, False)
+            fits[quarter] = pool.submit(fit_quarter, vintage_dir, quarter, first, previous, cache_dir)
+        refits = {}
+        for quarter, fit in fits.items():
+            packed_start, nowcast, news_df = fit.result()
+            nowcasts.append(nowcast)
+            news.append(news_df)
+            first = firsts[quarter]
+            backtested = {vintage for vintage, _ in plan[quarter]}
+            # The vintages of the backtest, and the previous vintages of the quarter they are compared with
+            needed = sorted({v for pair in plan[quarter] if pair[0] != first for v in pair} - {first}, key = vintage_date)
+            refits[quarter] = {first: packed_start}
+            refits[quarter].update({v: pool.submit(refit_vintage, vintage_dir, quarter, first, v, packed_start, cache_dir,
+                                                   v in backtested) for v in needed})
+        starts = {}
+        for quarter, quarter_refits in refits.items():
+            for vintage, refit in quarter_refits.items():
+                if isinstance(refit, Future):
+                    starts[quarter, vintage], nowcast = refit.result()
+                    nowcasts.append(nowcast)
+                else:
+                    starts[quarter, vintage] = refit
+        # The news of each later vintage relative to the previous one, from the estimates of both
+        pairs = [pool.submit(vintage_news, vintage_dir, quarter, firsts[quarter], vintage, previous,
+                             starts[quarter, vintage], starts[quarter, previous], cache_dir)
+                 for quarter in plan for vintage, previous in plan[quarter] if vintage != firsts[quarter]]
+        news += [pair.result() for pair in pairs]
+    nowcasts = [x for x in nowcasts if x is not None]
+    news = [x for x in news if x is not None]
+    return (pd.concat(nowcasts).reset_index(drop = True) if nowcasts else None,
+            pd.concat(news).reset_index(drop = True) if news else None)
+
+def write_backtest(nowcast, news, output_dir = "nowcast"):
+    # Single merge of the backtest into the store (see nowcast_store.py): rows for the backtested dates are
+    # replaced, and only the partitions of the backtested quarters are rewritten. The csv files are exported after.
+    store_dir = ensure_store(output_dir, os.path.join(output_dir, "store"))
+    append_table(store_dir, "nowcast", nowcast)
+    append_table(store_dir, "news", news)
+    export_csv(store_dir, output_dir)
+
+# %%
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Backtest the SA nowcast over all vintages")
+    parser.add_argument("--vintage-dir", default = "vintages")
+    parser.add_argument("--output-dir", default = "nowcast")
+    parser.add_argument("--start", help = "first vintage date to backtest (YYYY-MM-DD)")
+    parser.add_argument("--end", help = "last vintage date to backtest (YYYY-MM-DD)")
+    parser.add_argument("--workers", type = int, help = "number of processes, each up to ~2.5GB of memory " +
+                             "(default: all cores, as many as fit in the available memory; 1 = serial)")
+    parser.add_argument("--dry-run", action = "store_true", help = "only print the vintages that would be run")
+    args = parser.parse_args()
+    if args.workers is not None and args.workers < 1:
+        parser.error("--workers must be at least 1")
+
+    if args.dry_run:
+        for quarter, vintages in backtest_plan(args.vintage_dir, args.start, args.end).items():
+            print(quarter, [v for v, _ in vintages])
+    else:
+        with Timer() as timer:
+            nowcast, news = run_backtest(args.vintage_dir, args.start, args.end, args.workers)
+            write_backtest(nowcast, news, args.output_dir)
+        print(f"Backtested {0 if nowcast is None else len(nowcast)} vintages in {timer.seconds:.1f}s")
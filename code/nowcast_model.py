@@ -0,0 +1,132 @@
+# %%
+# The nowcasting model and the per-vintage steps shared by the weekly run (nowcast_auto_econdata.py) and
+# the backtest (nowcast_backtest.py)
+import os
+import re
+import pandas as pd
+from collections.abc import Mapping
+from datetime import datetime
+from statsmodels.tsa.api import DynamicFactorMQ
+from vintage_cache import VintageSheets
+
+# Cache of parsed vintage workbooks (set to None to always read the .xlsx files)
+CACHE_DIR = "cache/vintages"
+# Start of the model data
+START = "2000-01-01"
+NOWCAST_VARIABLES = ["UNEMP", "GDP", "RGDP"]
+FACTOR_MULTIPLICITIES = dict(Global = 2, Real = 2, Financial = 1, Fiscal = 2, External = 2)
+FACTOR_ORDERS = 2
+NEWS_COLUMNS = ["date", "quarter", "impact date", "impacted variable", "update date", "updated variable",
+                "observed", "forecast (prev)", "news", "weight", "impact"]
+
+# %%
+class Vintage(Mapping):
+    # The model data of a vintage workbook, as a read-only dict whose entries are read on first access: only
+    # the sheets a step uses are parsed or paged in from the vintage cache, and only from START on.
+    # The series metadata can be given, e.g. shared from the first vintage of the quarter
+    KEYS = ["series", "series_m", "series_q", "data", "data_logdiff", "gdp", "gdp_logdiff"]
+    SHEETS = dict(data = "data_m", data_logdiff = "data_logdiff_m", gdp = "data_q", gdp_logdiff = "data_logdiff_q")
+
+    def __init__(self, path, cache_dir = CACHE_DIR, series = None):
+        self.path = path
+        self.sheets = VintageSheets(path, cache_dir)
+        self.loaded = {} if series is None else dict(series = series)
+
+    def __getitem__(self, key):
+        if key not in self.loaded:
+            if key in self.SHEETS:
+                df = self.sheets.sheet(self.SHEETS[key], start = START)
+                df.index = df.index.to_period()
+            elif key == "series":
+                df = self.sheets.series()
+            elif key in ("series_m", "series_q"):
+                series = self["series"]
+                df = series.loc[series.freq == key[-1].upper()]
+            else:
+                raise KeyError(key)
+            self.loaded[key] = df
+        return self.loaded[key]
+
+    def __contains__(self, key):
+        return key in self.KEYS
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def __len__(self):
+        return len(self.KEYS)
+
+    def __repr__(self):
+        return f"Vintage({os.path.basename(self.path)}, loaded: {', '.join(self.loaded) or 'nothing'})"
+
+def load_vintage(path, cache_dir = CACHE_DIR, series = None):
+    # Reading through the vintage cache: the workbook is only parsed the first time it is seen
+    return Vintage(path, cache_dir, series)
+
+# %%
+# Vintages are named econdata_nowcast_data_DD_MM_YYYY.xlsx
+VINTAGE_PATTERN = re.compile(r"econdata_nowcast_data_(\d{2})_(\d{2})_(\d{4})\.xlsx")
+
+def is_vintage(vintage):
+    return VINTAGE_PATTERN.fullmatch(os.path.basename(vintage)) is not None
+
+def vintage_date(vintage):
+    # Date of a vintage file name (or path)
+    match = VINTAGE_PATTERN.fullmatch(os.path.basename(vintage))
+    if match is None:
+        raise ValueError(f"{vintage} is not a vintage file name (econdata_nowcast_data_DD_MM_YYYY.xlsx)")
+    day, month, year = match.groups()
+    return datetime(int(year), int(month), int(day))
+
+def list_vintages(vintage_dir = "vintages"):
+    # Vintage file names sorted by vintage date (other files, e.g. Excel lock files, are ignored)
+    return sorted((x for x in os.listdir(vintage_dir) if is_vintage(x)), key = vintage_date)
+
+def quarter_month(quarter):
+    # Last month of the quarter: the impact date of the nowcast
+    return quarter.to_timestamp(freq = "M", how = "end").to_period(freq = "M")
+
+# %%
+# Factor specification from the series metadata: a global factor and a broad sector factor for every series
+def dfm_model(data):
+    series = data["series"]
+    factors = {l: ['Global', v] for l, v in zip(series.series, series.broad_sector)}
+    return DynamicFactorMQ(endog=data["data_logdiff"],
+                           endog_quarterly=data["gdp_logdiff"][NOWCAST_VARIABLES],
+                           factors=factors,
+                           factor_multiplicities=FACTOR_MULTIPLICITIES,
+                           factor_orders=FACTOR_ORDERS)
+
+# The model of the first vintage of the quarter applied to another vintage, retaining its standardization
+def refit_model(first_model, data):
+    return first_model.clone(endog = data["data_logdiff"],
+                             endog_quarterly=data["gdp_logdiff"][NOWCAST_VARIABLES],
+                             retain_standardization = True)
+
+# %%
+def nowcast_frame(results, date, quarter):
+    # Nowcast row for the nowcast csv
+    nowcast = results.get_prediction(start = quarter_month(quarter)).predicted_mean[NOWCAST_VARIABLES]
+    nowcast["date"] = date
+    nowcast["quarter"] = str(quarter)
+    return nowcast[["date", "quarter"] + NOWCAST_VARIABLES]
+
+def compute_news(results, previous_results, quarter):
+    return results.news(previous_results,
+                        impact_date = str(quarter_month(quarter)),
+                        impacted_variable = NOWCAST_VARIABLES,
+                        comparison_type = "previous")
+
+def news_frame(news, date, quarter):
+    # Rows for the news csv
+    news_df = news.details_by_impact.reset_index()
+    news_df["impact date"] = pd.PeriodIndex(news_df["impact date"]).to_timestamp(freq="Q")
+    news_df["quarter"] = str(quarter)
+    news_df["date"] = date
+    return news_df[NEWS_COLUMNS]
+
+def merge_by_date(old, new):
+    # Replace the rows of `old` for the dates in `new`, keeping the file sorted by date
+    dates = set(pd.to_datetime(new.date))
+    return pd.concat([old.loc[~pd.to_datetime(old.date).isin(dates)], new[old.columns]]) \
+             .sort_values("date", key = pd.to_datetime, kind = "stable").reset_index(drop = True)
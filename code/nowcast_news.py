@@ -0,0 +1,111 @@
+# %%
+# Incremental news: the news of every pair of consecutive vintages in a quarter, computing only the pairs
+# that are missing from the news csv.
+# The weekly run computes the news of the latest vintage relative to the previous one. If a week is
+# skipped or a run fails, the pairs in between would otherwise be lost. Results per vintage are restored from
+# the estimates in the parameter store (a single smoothing pass, no EM, no workbook; see model_registry.py);
+# only vintages without stored estimates are fitted. A results object takes ~350MB, so at most the two results
+# of a pair are kept in memory, and results that no remaining pair needs are released as soon as their last
+# pair is computed. Pairs that have been computed are recorded (including pairs without any news, which leave
+# no rows in the csv), so reruns are idempotent.
+import os
+import json
+import pandas as pd
+from nowcast_model import CACHE_DIR, load_vintage, vintage_date, refit_model, compute_news, news_frame, merge_by_date
+from model_store import PARAMS_DIR, load_params, save_params, fit_warm, restore_results, log_fit, Timer
+from model_registry import ModelRegistry
+
+NEWS_LOG = "news_pairs.json"
+
+# %%
+def news_pairs(vintages, quarter):
+    # (previous, vintage) pairs of consecutive vintages where the later one is in the quarter. The first
+    # vintage of the quarter is compared with the last vintage of the preceding quarter.
+    vintages = sorted(vintages, key = vintage_date)
+    return [(vintages[i-1], v) for i, v in enumerate(vintages)
+            if i > 0 and pd.Period(vintage_date(v), freq="Q") == quarter]
+
+def news_log_path(store_dir, quarter):
+    return os.path.join(store_dir, str(quarter), NEWS_LOG)
+
+def read_news_log(store_dir, quarter):
+    path = news_log_path(store_dir, quarter)
+    if not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return {tuple(pair) for pair in json.load(f)}
+
+def write_news_log(store_dir, quarter, pairs):
+    path = news_log_path(store_dir, quarter)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(sorted(pairs), f, indent=1)
+
+def missing_news_pairs(vintages, quarter, news, store_dir = PARAMS_DIR):
+    # Pairs whose vintage date has no rows in the news frame and that have not been computed before
+    done = read_news_log(store_dir, quarter)
+    dates = set(pd.to_datetime(news.date))
+    return [(p, v) for p, v in news_pairs(vintages, quarter)
+            if (p, v) not in done and pd.Timestamp(vintage_date(v)) not in dates]
+
+# %%
+class VintageResults:
+    # DFM results per vintage of a quarter, all with the standardization of the quarter's first vintage, held by
+    # a registry that keeps at most a pair of them in memory. first_start is the (parameters, initialization)
+    # pair of the first vintage, that vintages without stored estimates are fitted from. cache_dir and
+    # fit_kwargs (e.g. the EM method) are those of the pipeline; the fits are logged in `fits`
+    def __init__(self, vintage_dir, quarter, dfm_first, first_start, store_dir = PARAMS_DIR, cache_dir = CACHE_DIR,
+                 fit_kwargs = None):
+        self.vintage_dir = vintage_dir
+        self.quarter = quarter
+        self.dfm_first = dfm_first
+        self.first_start = first_start
+        self.store_dir = store_dir
+        self.registry = ModelRegistry(store_dir)
+        self.cache_dir = cache_dir
+        self.fit_kwargs = {} if fit_kwargs is None else fit_kwargs
+        self.fits = []
+
+    def add(self, vintage, results):
+        self.registry.add(self.quarter, vintage, results)
+
+    def release(self, vintage):
+        self.registry.evict(self.quarter, vintage)
+
+    def __getitem__(self, vintage):
+        results = self.registry.get(self.quarter, vintage)
+        if results is None:
+            # No stored estimates (refitted), or stored without the model data by an older version (restored on
+            # the model data of the workbook); either way they are stored with the model data for the next time
+            dfm = refit_model(self.dfm_first, load_vintage(os.path.join(self.vintage_dir, vintage), self.cache_dir))
+            stored = load_params(self.store_dir, self.quarter, vintage, dfm)
+            if stored is not None:
+                results = restore_results(dfm, stored)
+            else:
+                print(f"No stored estimates for {vintage}: refitting")
+                with Timer() as timer:
+                    results = fit_warm(dfm, self.first_start, **self.fit_kwargs)
+                self.fits.append(log_fit(self.store_dir, self.quarter, vintage, "news refit", results, timer.seconds,
+                                         False))
+            save_params(self.store_dir, self.quarter, vintage, results)
+            self.registry.add(self.quarter, vintage, results)
+        return results
+
+def incremental_news(vintage_results, pairs):
+    # News rows for the given (previous, vintage) pairs, and the pairs computed
+    quarter = vintage_results.quarter
+    frames = []
+    for i, (previous, vintage) in enumerate(pairs):
+        news = compute_news(vintage_results[vintage], vintage_results[previous], quarter)
+        frames.append(news_frame(news, vintage_date(vintage).date(), quarter))
+        del news  # It holds the results of both vintages, which may be released below
+        print(f"Computed the news of {vintage} relative to {previous}: {len(frames[-1])} rows")
+        needed = {v for pair in pairs[i+1:] for v in pair}
+        for v in (previous, vintage):
+            if v not in needed:
+                vintage_results.release(v)
+    return (pd.concat(frames) if frames else None), set(pairs)
+
+def append_news(news_old, news_new):
+    # Idempotent append: rows for the dates in news_new replace any existing rows for those dates
+    return news_old if news_new is None else merge_by_date(news_old, news_new)
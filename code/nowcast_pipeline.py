@@ -0,0 +1,268 @@
+# %%
+# The weekly nowcast as a pipeline of explicit stages, for any vintage date:
+#   discover  the latest vintage up to the target date, the previous vintage and the first vintage of its quarter
+#   load      the three vintages (through the vintage cache)
+#   fit       the DFM on the first vintage of the quarter (restored or warm-started from stored estimates)
+#   apply     the model to the previous and latest vintages (skip, filter or refit depending on what changed)
+#   predict   the nowcasts of the quarter
+#   news      the news of the latest vintage, and of earlier pairs of vintages missing from the news (the
+#             results of the run are released here: restore them with model_registry.ModelRegistry)
+#   persist   the nowcast and news of the quarter to the store (and the csv files), the series and gdp csv files
+# Each stage is timed in a run report (see run_report.py). `run` calls all stages in order; they can also be
+# called one by one, e.g. in an interactive session.
+#
+#   python code/nowcast_pipeline.py                                   # latest vintage (= nowcast_auto_econdata.py)
+#   python code/nowcast_pipeline.py --date 2024-02-16 --date 2023-12-22 --workers 2
+#   python code/nowcast_pipeline.py --em squarem --em-tolerance 1e-5   # accelerated EM (see em_acceleration.py)
+import os
+import argparse
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from nowcast_model import (CACHE_DIR, NOWCAST_VARIABLES, load_vintage, list_vintages, vintage_date, quarter_month,
+                           dfm_model, refit_model, nowcast_frame, compute_news, news_frame, merge_by_date)
+from model_store import (PARAMS_DIR, load_params, save_params, stored_data_match, warm_start, fit_warm, restore_results,
+                         log_fit, Timer, quarter_lock)
+from vintage_diff import diff_vintages, REVISION_TOL
+from nowcast_news import VintageResults, missing_news_pairs, incremental_news, read_news_log, write_news_log, append_news
+from nowcast_store import ensure_store, read_partition, write_partition, export_csv
+from run_report import RunReport, REPORT_DIR
+from em_acceleration import EM_METHODS, SQUAREM_TOLERANCE
+
+STAGES = ["discover", "load", "fit", "apply", "predict", "news", "persist"]
+SERIES_COLUMNS = ["series", "series_orig", "dataset", "label", "freq", "unit", "seas_adj", "broad_sector", "topic"]
+
+# %%
+class NowcastPipeline:
+    def __init__(self, vintage_dir = "vintages", output_dir = "nowcast", date = None, params_dir = PARAMS_DIR,
+                 cache_dir = CACHE_DIR, report_dir = REPORT_DIR, revision_tol = REVISION_TOL, export = True,
+                 em_method = "em", em_tolerance = None):
+        # date: the nowcast is run for the latest vintage up to this date (default: the latest vintage).
+        # export: whether persist also exports the csv files from the store.
+        # revision_tol: revisions (in standard deviations) up to which the older estimates are applied without EM
+        # (default: none, any revision triggers a refit).
+        # em_method, em_tolerance: EM of statsmodels ("em", default tolerance 1e-6) or accelerated EM ("squarem",
+        # default tolerance SQUAREM_TOLERANCE) for the fits
+        self.vintage_dir = vintage_dir
+        self.output_dir = output_dir
+        self.store_dir = os.path.join(output_dir, "store")
+        self.date = None if date is None else pd.Timestamp(date)
+        self.params_dir = params_dir
+        self.cache_dir = cache_dir
+        self.revision_tol = revision_tol
+        self.export = export
+        self.fit_kwargs = dict(method = em_method)
+        if em_tolerance is not None:
+            self.fit_kwargs["tolerance"] = em_tolerance
+        self.report = RunReport("nowcast" if date is None else f"nowcast-{self.date.date()}", report_dir)
+        # Record of the current stage in the run report (metrics are added to it)
+        self.stage = {}
+
+    def run(self):
+        self.stage = self.report.start(STAGES[0])
+        self.discover()
+        # The later stages hold the lock on the quarter's estimates (see model_store.quarter_lock)
+        with quarter_lock(self.params_dir, self.quarter):
+            for name in STAGES[1:]:
+                self.stage = self.report.start(name)
+                getattr(self, name)()
+        self.report.write()
+        return self
+
+    # %%
+    def discover(self):
+        vintages = list_vintages(self.vintage_dir)
+        self.is_latest = self.date is None or self.date >= vintage_date(vintages[-1])
+        if self.date is not None:
+            vintages = [v for v in vintages if vintage_date(v) <= self.date]
+        if len(vintages) < 2:
+            raise ValueError(f"Need at least 2 vintages up to {self.date}, found {len(vintages)}")
+        self.vintages = vintages
+        self.latest_vintage, self.previous_vintage = vintages[-1], vintages[-2]
+        # The first vintage of the quarter is used for the standardization of all vintages in the quarter
+        self.today = vintage_date(self.latest_vintage).date()
+        self.quarter = pd.Period(self.today, freq="Q")
+        self.month = quarter_month(self.quarter)
+        vintages_this_quarter = [v for v in vintages if pd.Period(vintage_date(v), freq="Q") == self.quarter]
+        self.first_vintage = vintages_this_quarter[0]
+        print(f"\nToday is {self.today}. We are nowcasting for Quarter {self.quarter}. This is month {self.month}.\n" +
+              f"The latest vintage is {self.latest_vintage} from {vintage_date(self.latest_vintage)}.\n" +
+              f"The previous vintage is {self.previous_vintage} from {vintage_date(self.previous_vintage)}.\n" +
+              f"The first vintage for this quarter is {self.first_vintage} from {vintage_date(self.first_vintage)}.\n" +
+              f"There are {len(vintages_this_quarter)} vintages for this quarter so far.\n")
+        self.report.add(quarter = str(self.quarter), latest_vintage = self.latest_vintage, vintages = len(vintages),
+                        previous_vintage = self.previous_vintage, first_vintage = self.first_vintage, **self.fit_kwargs)
+
+    def load_vintage(self, vintage, series = None):
+        return load_vintage(os.path.join(self.vintage_dir, vintage), self.cache_dir, series)
+
+    def load(self):
+        # The vintages are read lazily, sheet by sheet; the later vintages share the series metadata of the first
+        self.first_data = self.load_vintage(self.first_vintage)
+        series = self.first_data["series"]
+        self.previous_data = self.first_data if self.previous_vintage == self.first_vintage else \
+            self.load_vintage(self.previous_vintage, series)
+        self.latest_data = self.first_data if self.latest_vintage == self.first_vintage else \
+            self.load_vintage(self.latest_vintage, series)
+        print("loaded vintages successfully")
+        print(self.first_data["series"].groupby('broad_sector', sort=False)["series"].count())
+
+    # %%
+    def fit(self):
+        self.dfm_first = dfm_model(self.first_data)
+        # The results stored for this vintage by an earlier run are restored if they were estimated on the same
+        # data; otherwise EM is warm-started from the stored parameters (if any)
+        start = load_params(self.params_dir, self.quarter, self.first_vintage, self.dfm_first)
+        restore = start is not None and stored_data_match(self.params_dir, self.quarter, self.first_vintage,
+                                                          self.dfm_first)
+        with Timer() as timer:
+            if restore:
+                self.first_results = restore_results(self.dfm_first, start)
+            else:
+                self.first_results = fit_warm(self.dfm_first, start, disp=10, **self.fit_kwargs)
+        row = log_fit(self.params_dir, self.quarter, self.first_vintage, "restore" if restore else "fit",
+                      self.first_results, timer.seconds, start is not None, iterations = 0 if restore else None)
+        self.stage.update(em_iterations = row["iterations"], llf = row["llf"], warm_start = row["warm_start"],
+                          restored = restore)
+        if not restore:
+            save_params(self.params_dir, self.quarter, self.first_vintage, self.first_results)
+        print("fitted dfm successfully")
+
+    def update_vintage(self, data, vintage, base_data, base_results):
+        # Updates the model from an older vintage: "skip" if nothing changed (same results), "filter" if only new
+        # data points arrived, or revisions within revision_tol (the older estimates applied to the new data, no
+        # EM), else "refit", from the parameters stored for the vintage by an earlier run, else from the older
+        # results. Results stored for the vintage by an earlier run on the same data are restored instead
+        # ("restore").
+        changes = diff_vintages(base_data, data)
+        mode = changes.update_mode(self.revision_tol)
+        print(f"{vintage}: {changes} -> {mode}")
+        fits = self.stage.setdefault("fits", [])
+        if mode == "skip":
+            fits.append(dict(vintage = vintage, stage = mode, iterations = 0, llf = float(base_results.llf)))
+            if not stored_data_match(self.params_dir, self.quarter, vintage, base_results.model):
+                save_params(self.params_dir, self.quarter, vintage, base_results)
+            return base_results
+        dfm = refit_model(self.dfm_first, data)
+        stored = load_params(self.params_dir, self.quarter, vintage, dfm)
+        if stored is not None and stored_data_match(self.params_dir, self.quarter, vintage, dfm):
+            mode = "restore"
+        with Timer() as timer:
+            if mode == "restore":
+                results = restore_results(dfm, stored)
+            elif mode == "filter":
+                results = restore_results(dfm, warm_start(base_results))
+            else:
+                results = fit_warm(dfm, warm_start(base_results) if stored is None else stored, **self.fit_kwargs)
+        fits.append(log_fit(self.params_dir, self.quarter, vintage, mode, results, timer.seconds,
+                            stored is not None and mode != "filter", iterations = None if mode == "refit" else 0))
+        if mode != "restore":
+            save_params(self.params_dir, self.quarter, vintage, results)
+        return results
+
+    def apply(self):
+        self.previous_results = self.first_results if self.previous_vintage == self.first_vintage else \
+            self.update_vintage(self.previous_data, self.previous_vintage, self.first_data, self.first_results)
+        # The latest vintage is closest to the previous one, so start from its estimates
+        self.latest_results = self.first_results if self.latest_vintage == self.first_vintage else \
+            self.update_vintage(self.latest_data, self.latest_vintage, self.previous_data, self.previous_results)
+        print("applied dfm to other vintages successfully")
+
+    # %%
+    def predict(self):
+        for label, results in [("First", self.first_results), ("Previous", self.previous_results),
+                               ("Current", self.latest_results)]:
+            print(f"{label} Nowcast")
+            print(results.get_prediction(start = self.month).predicted_mean[NOWCAST_VARIABLES])
+        self.nowcast = nowcast_frame(self.latest_results, self.today, self.quarter)
+        print(self.nowcast)
+
+    def news(self):
+        news = compute_news(self.latest_results, self.previous_results, self.quarter)
+        print(news.summary(float_format='%.6f'))
+        self.news_df = news_frame(news, self.today, self.quarter)
+        del news  # It holds the results of both vintages
+        # The news of earlier pairs of consecutive vintages this quarter that are missing from the news (e.g. after
+        # a skipped week), from the stored estimates of each vintage
+        ensure_store(self.output_dir, self.store_dir)
+        news_old = read_partition(self.store_dir, "news", self.quarter)
+        self.news_old = self.news_df.iloc[:0] if news_old is None else \
+            news_old.loc[pd.to_datetime(news_old.date) != pd.Timestamp(self.today)]
+        vintage_results = VintageResults(self.vintage_dir, self.quarter, self.dfm_first, warm_start(self.first_results),
+                                         self.params_dir, self.cache_dir, self.fit_kwargs)
+        # The results of the run are handed over to it (it keeps the last two), and restored from the parameter
+        # store if a missing pair needs them again
+        vintage_results.add(self.first_vintage, self.first_results)
+        vintage_results.add(self.previous_vintage, self.previous_results)
+        vintage_results.add(self.latest_vintage, self.latest_results)
+        self.first_results = self.previous_results = self.latest_results = None
+        pairs = [x for x in missing_news_pairs(self.vintages, self.quarter, self.news_old, self.params_dir)
+                 if x != (self.previous_vintage, self.latest_vintage)]
+        self.news_missing, self.news_computed = incremental_news(vintage_results, pairs)
+        self.stage.update(pairs = 1 + len(self.news_computed), fits = vintage_results.fits,
+                          rows = len(self.news_df) + (0 if self.news_missing is None else len(self.news_missing)))
+
+    # %%
+    def persist(self):
+        # Series and gdp csv files: only from the newest vintage (a run for an earlier date leaves them alone)
+        if self.is_latest:
+            self.first_data["series"][SERIES_COLUMNS].to_csv(os.path.join(self.output_dir, "series.csv"), index=False)
+            self.latest_data["gdp"].to_csv(os.path.join(self.output_dir, "gdp.csv"), index_label="quarter")
+            self.latest_data["gdp_logdiff"].to_csv(os.path.join(self.output_dir, "gdp_logdiff.csv"), index_label="quarter")
+        # Nowcast and news of this quarter: rows for this date (and the missing pairs) replace any existing rows
+        ensure_store(self.output_dir, self.store_dir)
+        nowcast_old = read_partition(self.store_dir, "nowcast", self.quarter)
+        write_partition(self.store_dir, "nowcast", self.quarter,
+                        self.nowcast if nowcast_old is None else merge_by_date(nowcast_old, self.nowcast))
+        news_all = append_news(append_news(self.news_old, self.news_missing), self.news_df)
+        write_partition(self.store_dir, "news", self.quarter, news_all)
+        write_news_log(self.params_dir, self.quarter, read_news_log(self.params_dir, self.quarter) | self.news_computed |
+                       {(self.previous_vintage, self.latest_vintage)})
+        if self.export:
+            export_csv(self.store_dir, self.output_dir)
+
+# %%
+def run_dates(dates, **kwargs):
+    # Pipelines for the given dates in date order (without exporting the csv files)
+    for date in sorted(dates):
+        NowcastPipeline(date = date, export = False, **kwargs).run()
+
+def run_pipelines(dates = None, vintage_dir = "vintages", output_dir = "nowcast", workers = 1, **kwargs):
+    # Runs the pipeline for each date (default: the latest vintage). Dates in the same quarter share the
+    # quarter's stored estimates and outputs, so they run in order in one process; quarters run in parallel.
+    kwargs.update(vintage_dir = vintage_dir, output_dir = output_dir)
+    if not dates:
+        NowcastPipeline(**kwargs).run()
+        return
+    by_quarter = {}
+    for date in pd.to_datetime(dates):
+        by_quarter.setdefault(pd.Period(date, freq="Q"), []).append(date)
+    if workers > 1 and len(by_quarter) > 1:
+        with ProcessPoolExecutor(min(workers, len(by_quarter))) as pool:
+            for future in [pool.submit(run_dates, quarter_dates, **kwargs) for quarter_dates in by_quarter.values()]:
+                future.result()
+    else:
+        for quarter_dates in by_quarter.values():
+            run_dates(quarter_dates, **kwargs)
+    export_csv(os.path.join(output_dir, "store"), output_dir)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Run the SA nowcast")
+    parser.add_argument("--vintage-dir", default = "vintages")
+    parser.add_argument("--output-dir", default = "nowcast")
+    parser.add_argument("--date", action = "append",
+                        help = "run for the latest vintage up to this date (YYYY-MM-DD, repeatable; default: latest vintage)")
+    parser.add_argument("--workers", type = int, default = 1, help = "processes for runs in different quarters")
+    parser.add_argument("--revision-tol", type = float, default = REVISION_TOL,
+                        help = "apply the previous estimates without EM to revisions up to this many standard " +
+                               "deviations (default: refit on any revision)")
+    parser.add_argument("--em", choices = EM_METHODS, default = "em", help = "EM of statsmodels or accelerated EM")
+    parser.add_argument("--em-tolerance", type = float,
+                        help = f"relative llf change at which EM stops (default 1e-6, {SQUAREM_TOLERANCE} with squarem)")
+    args = parser.parse_args(argv)
+    with Timer() as timer:
+        run_pipelines(args.date, args.vintage_dir, args.output_dir, args.workers,
+                      revision_tol = args.revision_tol, em_method = args.em, em_tolerance = args.em_tolerance)
+    print(f"Done in {timer.seconds:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# %%
+# Compact storage of the nowcast outputs (nowcast and news tables), partitioned by quarter.
+# news.csv is rewritten in full every week and repeats the same strings (dates, quarter, variable names) on
+# every row. Here each table is a directory with one Parquet file per quarter (nowcast/store/<table>/<quarter>.parquet):
+# string columns are stored as dictionary-encoded categoricals, the vintage date as a date and the numbers
+# as float64 (the values in the csv files round-trip exactly). A weekly run only rewrites the partition of its quarter.
+# The csv files are still published, but are exported from the store (export_csv).
+#
+#   python code/nowcast_store.py import   # (re)build the store from nowcast/*.csv
+#   python code/nowcast_store.py export   # write nowcast/*.csv from the store
+import os
+import argparse
+import pandas as pd
+from nowcast_model import merge_by_date
+
+STORE_DIR = "nowcast/store"
+TABLES = ["nowcast", "news"]
+
+# %%
+def partition_path(store_dir, table, quarter):
+    return os.path.join(store_dir, table, str(quarter) + ".parquet")
+
+def partitions(store_dir, table):
+    # Quarters stored for the table, in chronological order
+    path = os.path.join(store_dir, table)
+    if not os.path.isdir(path):
+        return []
+    return sorted((pd.Period(f[:-len(".parquet")], freq="Q") for f in os.listdir(path) if f.endswith(".parquet")))
+
+def has_table(store_dir, table):
+    return len(partitions(store_dir, table)) > 0
+
+def to_store(df):
+    # Typed columns: the date as datetime64, numbers as float64 and everything else as dictionary-encoded
+    # strings, formatted as in the csv files (e.g. the timestamps and periods of freshly computed news)
+    df = df.copy()
+    for col in df.columns:
+        x = df[col]
+        if col == "date":
+            df[col] = pd.to_datetime(x)
+        elif x.dtype.kind in "fiu":
+            df[col] = x.astype("float64")
+        else:
+            df[col] = x.astype(str).where(x.notna()).astype("category")
+    return df
+
+def from_store(df):
+    # The columns as they are in the csv files (strings)
+    df = df.copy()
+    for col in df.columns:
+        if col == "date":
+            df[col] = df[col].dt.strftime("%Y-%m-%d")
+        elif isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype(df[col].cat.categories.dtype)
+    return df
+
+# %%
+def read_partition(store_dir, table, quarter):
+    path = partition_path(store_dir, table, quarter)
+    return from_store(pd.read_parquet(path)) if os.path.exists(path) else None
+
+def write_partition(store_dir, table, quarter, df):
+    path = partition_path(store_dir, table, quarter)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = os.path.join(os.path.dirname(path), "." + os.path.basename(path))
+    to_store(df).to_parquet(tmp, index = False, compression = "zstd")
+    os.replace(tmp, path)
+    return path
+
+def read_table(store_dir, table, quarters = None):
+    # The table (or its partitions for the given quarters) with csv column types, sorted by date
+    if quarters is None:
+        # All partitions in one read (the file names sort chronologically, hidden temporary files are ignored)
+        return from_store(pd.read_parquet(os.path.join(store_dir, table))) if has_table(store_dir, table) else None
+    quarters = [pd.Period(q, freq="Q") for q in quarters]
+    frames = [df for df in (read_partition(store_dir, table, q) for q in quarters) if df is not None]
+    return pd.concat(frames, ignore_index = True) if frames else None
+
+def append_table(store_dir, table, new):
+    # Rows for the dates in `new` replace any existing rows for those dates. Only the partitions of the
+    # quarters in `new` are read and rewritten.
+    if new is None or len(new) == 0:
+        return []
+    paths = []
+    for quarter, rows in new.groupby("quarter", sort = True):
+        old = read_partition(store_dir, table, quarter)
+        rows = rows.reset_index(drop = True)
+        paths.append(write_partition(store_dir, table, quarter, rows if old is None else merge_by_date(old, rows)))
+    return paths
+
+# %%
+def import_csv(csv_dir = "nowcast", store_dir = STORE_DIR, tables = TABLES):
+    # (Re)build the store from the csv files
+    for table in tables:
+        # round_trip: the parser of the default precision can change the last digit of a float
+        df = pd.read_csv(os.path.join(csv_dir, table + ".csv"), float_precision = "round_trip")
+        for quarter, rows in df.groupby("quarter", sort = True):
+            write_partition(store_dir, table, quarter, rows.reset_index(drop = True))
+    return store_dir
+
+def export_csv(store_dir = STORE_DIR, csv_dir = "nowcast", tables = TABLES):
+    # Compatibility exporter: the csv files as they were written before the store existed
+    for table in tables:
+        df = read_table(store_dir, table)
+        if df is not None:
+            df.to_csv(os.path.join(csv_dir, table + ".csv"), index = False)
+    return csv_dir
+
+def ensure_store(csv_dir = "nowcast", store_dir = STORE_DIR):
+    # Imports the csv files on first use
+    missing = [t for t in TABLES if not has_table(store_dir, t) and os.path.exists(os.path.join(csv_dir, t + ".csv"))]
+    if missing:
+        import_csv(csv_dir, store_dir, missing)
+    return store_dir
+
+# %%
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Convert the nowcast outputs between the csv files and the store")
+    parser.add_argument("command", choices = ["import", "export"])
+    parser.add_argument("--csv-dir", default = "nowcast")
+    parser.add_argument("--store-dir", default = STORE_DIR)
+    args = parser.parse_args()
+    if args.command == "import":
+        print("Imported the csv files into", import_csv(args.csv_dir, args.store_dir))
+    else:
+        print("Exported the store to", export_csv(args.store_dir, args.csv_dir))
@@ -0,0 +1,135 @@
+# %%
+# Stage-level instrumentation of the weekly run.
+# Each stage of the run (load, fit, apply, predict, news, persist) is timed between report.start(name) and
+# report.stop() (or `with report.stage(name):`), which records the wall-clock and CPU time, the peak resident
+# memory of the process so far, and any metrics added to the stage (e.g. EM iterations and the final
+# log-likelihood). The report is written as JSON to cache/reports/ (one file per run), so runs can be compared
+# across weeks.
+#
+# Stages can also be profiled by setting NOWCAST_PROFILE to "cprofile" or "pyinstrument" (if installed),
+# optionally restricted to some stages with NOWCAST_PROFILE_STAGES=fit,news. The profiles are written next
+# to the report (<run>-<stage>.prof, readable with pstats or snakeviz, or <run>-<stage>.html).
+import os
+import sys
+import json
+import time
+import platform
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+REPORT_DIR = "cache/reports"
+PROFILERS = ["cprofile", "pyinstrument"]
+
+# %%
+def peak_rss_mb():
+    # Peak resident set size of the process so far (MB), None where it is not available
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return round(peak / 2**20 if sys.platform == "darwin" else peak / 2**10, 1)
+
+class Profiler:
+    # cProfile or pyinstrument around one stage
+    def __init__(self, kind):
+        self.kind = kind
+        if kind == "pyinstrument":
+            from pyinstrument import Profiler as PyinstrumentProfiler
+            self.profiler = PyinstrumentProfiler()
+        else:
+            import cProfile
+            self.profiler = cProfile.Profile()
+
+    def start(self):
+        self.profiler.start() if self.kind == "pyinstrument" else self.profiler.enable()
+
+    def stop(self, path):
+        if self.kind == "pyinstrument":
+            self.profiler.stop()
+            path += ".html"
+            with open(path, "w") as f:
+                f.write(self.profiler.output_html())
+        else:
+            self.profiler.disable()
+            path += ".prof"
+            self.profiler.dump_stats(path)
+        return path
+
+# %%
+class RunReport:
+    def __init__(self, name = "nowcast", report_dir = REPORT_DIR, profile = None, profile_stages = None):
+        self.report_dir = report_dir
+        self.started = datetime.now()
+        self.run = f"{name}-{self.started.strftime('%Y%m%d-%H%M%S')}"
+        self.info = {}
+        self.stages = []
+        self.current = None
+        self.profiler = None
+        self.profile = os.environ.get("NOWCAST_PROFILE") if profile is None else profile
+        if self.profile and self.profile not in PROFILERS:
+            raise ValueError(f"NOWCAST_PROFILE must be one of {PROFILERS}, got {self.profile!r}")
+        if profile_stages is None and os.environ.get("NOWCAST_PROFILE_STAGES"):
+            profile_stages = os.environ["NOWCAST_PROFILE_STAGES"].split(",")
+        self.profile_stages = None if profile_stages is None else set(profile_stages)
+
+    def add(self, **info):
+        # Run-level information (e.g. the vintages and the quarter)
+        self.info.update(info)
+
+    def start(self, name, **metrics):
+        # Starts a stage (ending the current one, if any) and returns its record, which takes the metrics of
+        # the stage (record["llf"] = ...)
+        if self.current is not None:
+            self.stop()
+        record = dict(stage = name, **metrics)
+        self.profiler = None
+        if self.profile and (self.profile_stages is None or name in self.profile_stages):
+            self.profiler = Profiler(self.profile)
+            self.profiler.start()
+        self.current = (record, time.perf_counter(), time.process_time())
+        return record
+
+    def stop(self):
+        record, wall, cpu = self.current
+        self.current = None
+        record["wall_seconds"] = round(time.perf_counter() - wall, 3)
+        record["cpu_seconds"] = round(time.process_time() - cpu, 3)
+        record["peak_rss_mb"] = peak_rss_mb()
+        if self.profiler is not None:
+            os.makedirs(self.report_dir, exist_ok=True)
+            record["profile"] = self.profiler.stop(os.path.join(self.report_dir, f"{self.run}-{record['stage']}"))
+            self.profiler = None
+        self.stages.append(record)
+        print(f"[{record['stage']}] {record['wall_seconds']}s wall, {record['cpu_seconds']}s CPU, " +
+              f"peak RSS {record['peak_rss_mb']} MB")
+        return record
+
+    @contextmanager
+    def stage(self, name, **metrics):
+        # `with report.stage(name) as record:`, the same as start(name) ... stop()
+        record = self.start(name, **metrics)
+        try:
+            yield record
+        finally:
+            self.stop()
+
+    def to_dict(self):
+        return dict(run = self.run, started = self.started.isoformat(timespec="seconds"),
+                    python = platform.python_version(), platform = platform.platform(),
+                    total_wall_seconds = round(sum(s["wall_seconds"] for s in self.stages), 3),
+                    peak_rss_mb = peak_rss_mb(), **self.info, stages = self.stages)
+
+    def write(self, path = None):
+        if self.current is not None:
+            self.stop()
+        path = os.path.join(self.report_dir, self.run + ".json") if path is None else path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=1, default=str)
+        print("Wrote the run report to", path)
+        return path
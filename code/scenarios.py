@@ -0,0 +1,188 @@
+# %%
+# What-if nowcasts: "what would the RGDP nowcast be if manufacturing came in at X?"
+# A scenario is a set of hypothetical releases (series, period, value) of data not yet released in the latest
+# vintage, in the units of the model data (data_logdiff, and gdp_logdiff for the quarterly variables).
+# Scenarios are evaluated on the fitted results of the latest vintage without re-estimation. The impact of
+# new data on the nowcast is linear in the data: impact = weight * (value - forecast), where the weights and
+# forecasts depend only on which cells are released, not on their values. So all scenarios that release the
+# same cells share one filter-only pass (statsmodels' news against the latest results, for the first of
+# them), and the nowcasts and news of the others follow in one vectorized step.
+#
+#   python code/scenarios.py scenarios.csv --output-dir scenarios [--date 2024-02-16]
+# with scenarios.csv in long format: scenario,series,period,value (period e.g. 2024-02, or 2024Q1 for GDP)
+import os
+import argparse
+import numpy as np
+import pandas as pd
+from nowcast_model import CACHE_DIR, NOWCAST_VARIABLES, NEWS_COLUMNS, quarter_month, vintage_date, dfm_model, refit_model
+from model_store import PARAMS_DIR, load_params, restore_results, warm_start
+
+SCENARIO_COLUMNS = ["scenario", "series", "period", "value"]
+BASELINE = "baseline"
+
+# %%
+def scenario_table(scenarios):
+    # Long table of scenarios given as {scenario: {series: {period: value}}} (e.g. from JSON)
+    rows = [(name, series, str(period), float(value)) for name, releases in scenarios.items()
+            for series, values in releases.items() for period, value in values.items()]
+    return pd.DataFrame(rows, columns = SCENARIO_COLUMNS)
+
+def read_scenarios(path):
+    table = pd.read_csv(path, dtype = dict(scenario = str, series = str, period = str))
+    missing = [c for c in SCENARIO_COLUMNS if c not in table.columns]
+    if missing:
+        raise ValueError(f"{path} has no column(s) {missing}, expected {SCENARIO_COLUMNS}")
+    return table[SCENARIO_COLUMNS]
+
+class ScenarioEngine:
+    # Scenarios on the results of the latest vintage (e.g. restored from the parameter store, see latest_engine)
+    # and the model data they were fitted on (NowcastPipeline.latest_data)
+    def __init__(self, results, data, quarter):
+        self.results = results
+        self.quarter = pd.Period(quarter, freq="Q")
+        self.month = quarter_month(self.quarter)
+        self.monthly = data["data_logdiff"]
+        self.quarterly = data["gdp_logdiff"][NOWCAST_VARIABLES]
+        # The published nowcast of the latest vintage (the same prediction as nowcast_frame)
+        self.baseline = results.get_prediction(start = self.month).predicted_mean[NOWCAST_VARIABLES].iloc[0]
+
+    def cell(self, series, period):
+        # (series, month of the release in the model, period in the frame of the series)
+        if series in self.quarterly.columns:
+            period = pd.Period(period, freq="Q")
+            return series, period.asfreq("M", how="end"), period
+        if series not in self.monthly.columns:
+            raise ValueError(f"Unknown series {series!r}")
+        period = pd.Period(period, freq="M")
+        return series, period, period
+
+    def released(self, series, period):
+        frame = self.quarterly if series in self.quarterly.columns else self.monthly
+        return period in frame.index and not np.isnan(frame.at[period, series])
+
+    def updated_data(self, cells, values):
+        # The model data with the releases of a scenario, extended to the months they cover
+        last = max([self.monthly.index[-1]] + [month for _, month, _ in cells])
+        monthly = self.monthly.reindex(pd.period_range(self.monthly.index[0], last, freq="M"))
+        quarterly = self.quarterly.reindex(pd.period_range(self.quarterly.index[0], last.asfreq("Q"), freq="Q"))
+        monthly.index.name, quarterly.index.name = self.monthly.index.name, self.quarterly.index.name
+        for (series, _, period), value in zip(cells, values):
+            frame = quarterly if series in quarterly.columns else monthly
+            frame.at[period, series] = value
+        return dict(data_logdiff = monthly, gdp_logdiff = quarterly)
+
+    def weights(self, cells, values):
+        # Forecasts of the cells and weights of their news in the nowcast (cells x NOWCAST_VARIABLES): one
+        # filter-only pass of the model with the parameters and initial state of the latest results
+        updated = restore_results(refit_model(self.results.model, self.updated_data(cells, values)),
+                                  warm_start(self.results))
+        news = self.results.news(updated, impact_date = str(self.month), impacted_variable = NOWCAST_VARIABLES,
+                                 comparison_type = "updated", tolerance = 0)
+        details = news.details_by_impact.reset_index()
+        details["cell"] = list(zip(details["updated variable"], pd.PeriodIndex(details["update date"], freq="M")))
+        keys = [(series, month) for series, month, _ in cells]
+        weights = details.pivot_table(index = "cell", columns = "impacted variable", values = "weight", aggfunc = "sum") \
+                         .reindex(index = keys, columns = NOWCAST_VARIABLES).fillna(0.0)
+        forecasts = details.groupby("cell")["forecast (prev)"].first().reindex(keys)
+        if forecasts.isna().any():
+            # Cells without any impact on the nowcast (their weights are 0): the forecast of the latest results,
+            # smoothed as the forecasts in the news are
+            months = [month for _, month, _ in cells]
+            predicted = self.results.get_prediction(start = min(months), end = max(months),
+                                                    information_set = "smoothed").predicted_mean
+            forecasts = forecasts.fillna(pd.Series([predicted.at[m, s] for s, m in keys], index = forecasts.index))
+        return forecasts.to_numpy(), weights.to_numpy()
+
+    def run(self, table):
+        # Nowcasts (one row per scenario, plus the baseline) and news (one row per scenario, release and
+        # nowcast variable) of a long table of scenarios
+        table = table.drop_duplicates(["scenario", "series", "period"], keep = "last")
+        cells = {}
+        for row in table.itertuples(index = False):
+            cell = self.cell(row.series, row.period)
+            if self.released(row.series, cell[2]):
+                raise ValueError(f"Scenario {row.scenario!r}: {row.series} {row.period} is already released")
+            cells.setdefault(row.scenario, {})[cell] = row.value
+        groups = {}
+        for name, releases in cells.items():
+            groups.setdefault(tuple(sorted(releases, key = lambda c: (c[1], c[0]))), []).append(name)
+        nowcasts, news = [pd.DataFrame([self.baseline.to_numpy()], index = [BASELINE], columns = NOWCAST_VARIABLES)], []
+        for key, names in groups.items():
+            values = np.array([[cells[name][cell] for cell in key] for name in names])
+            forecasts, weights = self.weights(key, values[0])
+            # scenarios x cells x variables
+            impacts = (values - forecasts)[:, :, None] * weights[None]
+            nowcasts.append(pd.DataFrame(self.baseline.to_numpy() + impacts.sum(axis = 1), index = names,
+                                         columns = NOWCAST_VARIABLES))
+            n, k, v = impacts.shape
+            news.append(pd.DataFrame({
+                "scenario": np.repeat(names, k * v),
+                "quarter": str(self.quarter),
+                "impact date": self.month.to_timestamp(how="end").normalize(),
+                "impacted variable": np.tile(NOWCAST_VARIABLES, n * k),
+                "update date": np.tile(np.repeat([str(c[2]) for c in key], v), n),
+                "updated variable": np.tile(np.repeat([c[0] for c in key], v), n),
+                "observed": np.repeat(values.ravel(), v),
+                "forecast (prev)": np.tile(np.repeat(forecasts, v), n),
+                "news": np.repeat((values - forecasts).ravel(), v),
+                "weight": np.tile(weights.ravel(), n),
+                "impact": impacts.ravel()}))
+        nowcasts = pd.concat(nowcasts).rename_axis("scenario").reset_index()
+        news = pd.concat(news, ignore_index = True) if news else pd.DataFrame(columns = ["scenario"] + NEWS_COLUMNS[1:])
+        return nowcasts, news
+
+def check_baseline(engine, nowcast_dir = "nowcast", tol = 1e-9):
+    # Raises ValueError if the baseline of the engine differs from the nowcast published for its vintage in
+    # nowcast.csv (e.g. the stored estimates are not those of the published run). Returns False if there is
+    # no published nowcast for the vintage yet.
+    path = os.path.join(nowcast_dir, "nowcast.csv")
+    if not os.path.exists(path):
+        return False
+    published = pd.read_csv(path, float_precision = "round_trip")
+    published = published.loc[pd.to_datetime(published.date) == vintage_date(engine.vintage), NOWCAST_VARIABLES]
+    if len(published) == 0:
+        return False
+    difference = np.abs(published.iloc[-1].to_numpy() - engine.baseline.to_numpy()).max()
+    if not difference <= tol:
+        raise ValueError(f"The baseline nowcast on {engine.vintage} differs from the published one in {path} " +
+                         f"by {difference:.3g}")
+    return True
+
+# %%
+def latest_engine(vintage_dir = "vintages", date = None, params_dir = PARAMS_DIR, cache_dir = CACHE_DIR):
+    # Scenario engine on the latest vintage up to `date`, restored from the estimates stored by the weekly run
+    from nowcast_pipeline import NowcastPipeline
+    pipeline = NowcastPipeline(vintage_dir, date = date, params_dir = params_dir, cache_dir = cache_dir)
+    pipeline.discover()
+    pipeline.load()
+    dfm_first = dfm_model(pipeline.first_data)
+    dfm = dfm_first if pipeline.latest_vintage == pipeline.first_vintage else refit_model(dfm_first, pipeline.latest_data)
+    stored = load_params(params_dir, pipeline.quarter, pipeline.latest_vintage, dfm)
+    if stored is None:
+        raise FileNotFoundError(f"No stored estimates for {pipeline.latest_vintage} in {params_dir}: " +
+                                "run the nowcast pipeline for it first")
+    engine = ScenarioEngine(restore_results(dfm, stored), pipeline.latest_data, pipeline.quarter)
+    engine.vintage = pipeline.latest_vintage
+    return engine
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Nowcasts and news of what-if scenarios on the latest vintage")
+    parser.add_argument("scenarios", help = "csv file with columns " + ",".join(SCENARIO_COLUMNS))
+    parser.add_argument("--vintage-dir", default = "vintages")
+    parser.add_argument("--date", help = "use the latest vintage up to this date (default: latest vintage)")
+    parser.add_argument("--output-dir", default = "scenarios")
+    parser.add_argument("--nowcast-dir", default = "nowcast", help = "published nowcasts, to check the baseline against")
+    args = parser.parse_args(argv)
+    engine = latest_engine(args.vintage_dir, args.date)
+    if not check_baseline(engine, args.nowcast_dir):
+        print(f"No published nowcast for {engine.vintage} in {args.nowcast_dir} to check the baseline against")
+    nowcasts, news = engine.run(read_scenarios(args.scenarios))
+    print(f"\nNowcasts for {engine.quarter} on {engine.vintage}:")
+    print(nowcasts.to_string(index = False))
+    os.makedirs(args.output_dir, exist_ok=True)
+    nowcasts.to_csv(os.path.join(args.output_dir, "nowcasts.csv"), index = False)
+    news.to_csv(os.path.join(args.output_dir, "news.csv"), index = False)
+    print("Wrote", os.path.join(args.output_dir, "nowcasts.csv"), "and news.csv")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+# %%
+# Persistent, content-hashed cache of the vintage workbooks.
+# Parsing the .xlsx files with openpyxl is the slowest part of the weekly run outside the DFM fit, so each
+# workbook is converted once into a directory of .npy arrays (one per data sheet plus its date index), a
+# small JSON manifest with the column names and a pickle of the series metadata. Later loads memory-map
+# the arrays. Entries are keyed by the SHA-256 of the workbook, so a changed file gets a new entry and the
+# stale one is removed.
+# VintageSheets reads the sheets of a vintage on first access only, and cuts the rows before a start date
+# before anything is parsed or paged in.
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+import pandas as pd
+
+CACHE_VERSION = 1
+DATA_SHEETS = ["data_m", "data_logdiff_m", "data_q", "data_logdiff_q"]
+
+# %%
+def file_hash(path, chunk_size = 1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def vintage_stem(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+def cache_entry(path, cache_dir):
+    return os.path.join(cache_dir, f"{vintage_stem(path)}-{file_hash(path)[:16]}")
+
+# %%
+def read_vintage_sheets(path):
+    # Parse the workbook once (rather than once per sheet)
+    with pd.ExcelFile(path, engine="openpyxl") as xl:
+        sheets = dict(series = xl.parse("series"))
+        for sheet in DATA_SHEETS:
+            sheets[sheet] = xl.parse(sheet, index_col="date", parse_dates=True)
+    return sheets
+
+def write_cache_entry(path, entry):
+    cache_dir = os.path.dirname(entry)
+    os.makedirs(cache_dir, exist_ok=True)
+    sheets = read_vintage_sheets(path)
+    tmp = tempfile.mkdtemp(prefix=".tmp-", dir=cache_dir)
+    try:
+        sheets["series"].to_pickle(os.path.join(tmp, "series.pkl"))
+        manifest = dict(version = CACHE_VERSION, source = os.path.basename(path), sheets = {})
+        for sheet in DATA_SHEETS:
+            df = sheets[sheet]
+            np.save(os.path.join(tmp, sheet + ".npy"), np.ascontiguousarray(df.to_numpy(dtype="float64")))
+            np.save(os.path.join(tmp, sheet + ".index.npy"), df.index.values)
+            manifest["sheets"][sheet] = [str(c) for c in df.columns]
+        with open(os.path.join(tmp, "manifest.json"), "w") as f:
+            json.dump(manifest, f)
+        # Drop entries for older contents of the same workbook, then publish the new entry atomically
+        prefix = vintage_stem(path) + "-"
+        for old in os.listdir(cache_dir):
+            if old.startswith(prefix) and os.path.join(cache_dir, old) != entry:
+                shutil.rmtree(os.path.join(cache_dir, old), ignore_errors=True)
+        if os.path.isdir(entry):  # Written concurrently by another process
+            shutil.rmtree(tmp, ignore_errors=True)
+        else:
+            os.rename(tmp, entry)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return sheets
+
+def read_manifest(entry):
+    with open(os.path.join(entry, "manifest.json")) as f:
+        manifest = json.load(f)
+    if manifest["version"] != CACHE_VERSION:
+        raise ValueError(f"Cache entry {entry} has version {manifest['version']}, expected {CACHE_VERSION}")
+    for sheet in manifest["sheets"]:
+        for name in [sheet + ".npy", sheet + ".index.npy"]:
+            if not os.path.isfile(os.path.join(entry, name)):
+                raise FileNotFoundError(f"Cache entry {entry} has no {name}")
+    return manifest
+
+def start_row(index, start):
+    # Position of the first date >= start (a binary search, as the date index of a sheet is sorted)
+    if start is None:
+        return 0
+    if not index.is_monotonic_increasing:
+        raise ValueError("The date index of a vintage sheet is not sorted")
+    return int(index.searchsorted(pd.Timestamp(start)))
+
+def read_cache_sheet(entry, sheet, columns, start = None, mmap_mode = "r"):
+    # A data sheet from the cache from `start` on: the rows before it are cut from the memory map, so they are
+    # never read from disk
+    index = pd.DatetimeIndex(np.load(os.path.join(entry, sheet + ".index.npy")), name="date")
+    row = start_row(index, start)
+    values = np.load(os.path.join(entry, sheet + ".npy"), mmap_mode=mmap_mode)
+    return pd.DataFrame(values[row:], index=index[row:], columns=columns, copy=False)
+
+def read_excel_sheet(path, sheet, start = None):
+    # A data sheet parsed from the workbook from `start` on. The dates of a sheet are regular (monthly or
+    # quarterly), so the number of rows before `start` follows from the first few dates and the reader skips
+    # them instead of parsing them into the frame
+    kwargs = dict(sheet_name=sheet, index_col="date", parse_dates=True, engine="openpyxl")
+    skip = 0
+    if start is not None:
+        head = pd.read_excel(path, nrows=3, **kwargs).index
+        freq = pd.infer_freq(head) if len(head) == 3 else None
+        if freq is not None:
+            skip = len(pd.date_range(head[0], pd.Timestamp(start), freq=freq, inclusive="left"))
+    df = pd.read_excel(path, skiprows=range(1, skip + 1), **kwargs)
+    if skip and len(df) and df.index[0] != pd.date_range(head[0], periods=skip + 1, freq=freq)[-1]:
+        # The dates are not regular after all: parse the whole sheet
+        df = pd.read_excel(path, **kwargs)
+    return df.iloc[start_row(df.index, start):]
+
+# %%
+class VintageSheets:
+    # The sheets of a vintage workbook, each read on first access: from the cache entry if there is a cache
+    # (built here if missing), else parsed from the workbook one sheet at a time
+    def __init__(self, path, cache_dir = None, mmap_mode = "r"):
+        self.path = path
+        self.mmap_mode = mmap_mode
+        self.entry = None if cache_dir is None else open_cache_entry(path, cache_dir)
+        self.manifest = None if self.entry is None else read_manifest(self.entry)
+
+    def series(self):
+        if self.entry is None:
+            return pd.read_excel(self.path, sheet_name="series", engine="openpyxl")
+        return pd.read_pickle(os.path.join(self.entry, "series.pkl"))
+
+    def sheet(self, sheet, start = None):
+        # A data sheet indexed by date, from `start` on
+        if self.entry is None:
+            return read_excel_sheet(self.path, sheet, start)
+        return read_cache_sheet(self.entry, sheet, self.manifest["sheets"][sheet], start, self.mmap_mode)
+
+def open_cache_entry(path, cache_dir):
+    # The cache entry of a workbook, checked and (re)built if needed
+    entry = cache_entry(path, cache_dir)
+    if os.path.isdir(entry):
+        try:
+            read_manifest(entry)
+            return entry
+        except Exception as e:  # Corrupt, outdated or unreadable entry: rebuild it
+            print(f"Rebuilding vintage cache entry {entry}: {e}")
+            shutil.rmtree(entry, ignore_errors=True)
+    write_cache_entry(path, entry)
+    return entry
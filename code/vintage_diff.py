@@ -0,0 +1,86 @@
+# %%
+# What changed between two vintages, before fitting anything.
+# The monthly (data_logdiff) and quarterly (gdp_logdiff) panels of both vintages are aligned on the union of
+# their periods and series, and every cell is classified with NumPy masks as a new release (missing in the
+# old vintage, observed in the new one), a revision (observed in the old vintage and changed by more than
+# `tol`, or withdrawn in the new one) or unchanged. Revisions also get their size in standard deviations of
+# the series, since the weekly re-run of the seasonal adjustment revises much of the history by tiny amounts.
+# The weekly run uses the resulting change set to skip refitting when nothing changed, and to apply the
+# previous estimates without EM when only new data points arrived. Any revision triggers a refit, unless a
+# looser `revision_tol` is asked for (it changes the nowcasts, as the estimates are then not updated).
+import numpy as np
+import pandas as pd
+from nowcast_model import NOWCAST_VARIABLES
+
+NEW_RELEASE = "new release"
+REVISION = "revision"
+# Revisions larger than this (in standard deviations of the series) trigger a refit. Revisions are cells that
+# changed by more than the numerical tolerance of diff_frames, so by default any revision does.
+REVISION_TOL = 0.0
+
+# %%
+def align(old, new):
+    index = old.index.union(new.index)
+    columns = old.columns.append(new.columns.difference(old.columns))
+    return (old.reindex(index = index, columns = columns).to_numpy(dtype = float),
+            new.reindex(index = index, columns = columns).to_numpy(dtype = float), index, columns)
+
+def diff_frames(old, new, tol = 1e-8):
+    # Changed cells of `new` relative to `old` as a long frame (period, variable, change, old, new, size),
+    # where size is the absolute revision in standard deviations (inf for withdrawn data, NaN for releases)
+    a, b, index, columns = align(old, new)
+    old_obs, new_obs = ~np.isnan(a), ~np.isnan(b)
+    released = new_obs & ~old_obs
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        delta = np.abs(b - a)
+        revised = old_obs & (~new_obs | (delta > tol))
+        size = np.where(new_obs, delta, np.inf) / np.nanstd(a, axis = 0)
+    rows, cols = np.nonzero(released | revised)
+    return pd.DataFrame({"period": index[rows], "variable": columns[cols],
+                         "change": np.where(released[rows, cols], NEW_RELEASE, REVISION),
+                         "old": a[rows, cols], "new": b[rows, cols], "size": size[rows, cols]})
+
+# %%
+class ChangeSet:
+    # Changed cells between two vintages (monthly and quarterly panels)
+    def __init__(self, monthly, quarterly):
+        self.monthly = monthly
+        self.quarterly = quarterly
+
+    @property
+    def changes(self):
+        return pd.concat([self.monthly.assign(freq = "M"), self.quarterly.assign(freq = "Q")], ignore_index = True)
+
+    def count(self, change):
+        return int((self.monthly.change == change).sum() + (self.quarterly.change == change).sum())
+
+    @property
+    def empty(self):
+        return len(self.monthly) == 0 and len(self.quarterly) == 0
+
+    @property
+    def only_new_releases(self):
+        return not self.empty and self.count(REVISION) == 0
+
+    @property
+    def max_revision(self):
+        sizes = [x.loc[x.change == REVISION, "size"] for x in (self.monthly, self.quarterly)]
+        return max((x.max() for x in sizes if len(x)), default = 0.0)
+
+    def update_mode(self, revision_tol = REVISION_TOL):
+        # How to update the model from the old to the new vintage: "skip" (reuse the results), "filter"
+        # (apply the old estimates to the new data, no EM) or "refit" (EM, warm-started from the old estimates)
+        if self.empty:
+            return "skip"
+        if self.count(REVISION) == 0:
+            return "filter"
+        return "filter" if revision_tol > 0 and self.max_revision <= revision_tol else "refit"
+
+    def __repr__(self):
+        return (f"ChangeSet({self.count(NEW_RELEASE)} new releases, {self.count(REVISION)} revisions, " +
+                f"largest revision {self.max_revision:.3g} sd)")
+
+def diff_vintages(old_data, new_data, tol = 1e-8):
+    # Change set of the model data (as returned by load_vintage) between two vintages
+    return ChangeSet(diff_frames(old_data["data_logdiff"], new_data["data_logdiff"], tol),
+                     diff_frames(old_data["gdp_logdiff"][NOWCAST_VARIABLES], new_data["gdp_logdiff"][NOWCAST_VARIABLES], tol))
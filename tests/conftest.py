@@ -0,0 +1,42 @@
+# %%
+# Shared fixtures of the tests. The modules are imported by name from code/ and app/, with the path setup of
+# the benchmarks. The DFM fit on the first vintage of 2024Q1 (about a minute) is shared by the tests that need
+# fitted results; it is the cold fit that produced the published nowcast of that vintage.
+import os
+import sys
+# One BLAS thread, as in the backtest, so that results are reproducible
+for var in ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "VECLIB_MAXIMUM_THREADS"]:
+    os.environ.setdefault(var, "1")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+from common import ROOT, add_paths
+add_paths()
+import pandas as pd
+import pytest
+from nowcast_model import NOWCAST_VARIABLES, load_vintage, vintage_date, dfm_model
+
+VINTAGE_DIR = os.path.join(ROOT, "vintages")
+NOWCAST_DIR = os.path.join(ROOT, "nowcast")
+QUARTER = pd.Period("2024Q1", freq="Q")
+FIRST_VINTAGE = "econdata_nowcast_data_05_01_2024.xlsx"
+SECOND_VINTAGE = "econdata_nowcast_data_12_01_2024.xlsx"
+# Published nowcasts are compared up to the rounding of different BLAS builds
+TOL = 1e-9
+
+# %%
+def published_nowcast(vintage):
+    # The nowcast of a vintage in the committed nowcast.csv
+    nowcast = pd.read_csv(os.path.join(NOWCAST_DIR, "nowcast.csv"), float_precision = "round_trip")
+    rows = nowcast.loc[pd.to_datetime(nowcast.date) == vintage_date(vintage), NOWCAST_VARIABLES]
+    assert len(rows) == 1, f"no published nowcast for {vintage}"
+    return rows.iloc[0]
+
+@pytest.fixture(scope = "session")
+def cache_dir(tmp_path_factory):
+    return str(tmp_path_factory.mktemp("vintages"))
+
+@pytest.fixture(scope = "session")
+def first_fit(cache_dir):
+    # The vintage data, model and EM results of the first vintage of the quarter
+    data = load_vintage(os.path.join(VINTAGE_DIR, FIRST_VINTAGE), cache_dir)
+    model = dfm_model(data)
+    return dict(data = data, model = model, results = model.fit())
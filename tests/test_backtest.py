@@ -0,0 +1,21 @@
+# %%
+# Backtest: the refits reproduce the nowcasts published by the serial weekly script
+import pandas as pd
+from conftest import VINTAGE_DIR, FIRST_VINTAGE, SECOND_VINTAGE, TOL, published_nowcast
+from nowcast_model import NOWCAST_VARIABLES
+from nowcast_backtest import backtest_plan, first_vintages, run_backtest
+
+# %%
+def test_backtest_plan():
+    plan = backtest_plan(VINTAGE_DIR, "2024-01-06", "2024-01-12")
+    assert plan == {pd.Period("2024Q1", freq="Q"): [(SECOND_VINTAGE, FIRST_VINTAGE)]}
+    assert first_vintages(VINTAGE_DIR, plan) == {pd.Period("2024Q1", freq="Q"): FIRST_VINTAGE}
+
+def test_backtest_quarter_matches_published(cache_dir):
+    # The quarter is fitted on its first vintage and the second vintage refitted from it
+    nowcast, news = run_backtest(VINTAGE_DIR, "2024-01-06", "2024-01-12", workers = 1, cache_dir = cache_dir)
+    assert list(nowcast.date.astype(str)) == ["2024-01-12"]
+    difference = (nowcast.iloc[0][NOWCAST_VARIABLES] - published_nowcast(SECOND_VINTAGE)).abs().max()
+    assert difference < TOL
+    # Both vintages have the same data: no news
+    assert news is None or len(news) == 0
@@ -0,0 +1,49 @@
+# %%
+# SQUAREM against the EM of statsmodels, on a small synthetic one-factor panel
+import numpy as np
+import pandas as pd
+import pytest
+from statsmodels.tsa.api import DynamicFactorMQ
+from em_acceleration import fit_squarem
+from model_store import fit_warm, restore_results
+
+# %%
+@pytest.fixture(scope = "module")
+def model():
+    rng = np.random.default_rng(0)
+    factor = np.zeros(240)
+    for t in range(1, len(factor)):
+        factor[t] = 0.8 * factor[t - 1] + rng.normal()
+    data = factor[:, None] * rng.uniform(0.5, 1.5, 6) + rng.normal(size = (len(factor), 6))
+    # Ragged edge, as in the vintages
+    data[-3:, 3:] = np.nan
+    data = pd.DataFrame(data, index = pd.period_range("2000-01", periods = len(factor), freq = "M"),
+                        columns = list("abcdef"))
+    return DynamicFactorMQ(data, factors = 1, factor_orders = 1)
+
+def test_squarem_reaches_the_em_likelihood(model):
+    em = model.fit()
+    squarem = fit_squarem(model, tolerance = 1e-6)
+    assert squarem.mle_retvals.converged
+    assert squarem.llf == pytest.approx(em.llf, rel = 1e-5)
+    # Iterations count the Kalman smoother runs of the EM steps, and the likelihood never dropped
+    assert 0 < squarem.mle_retvals.iter <= em.mle_retvals["iter"] + 3
+    assert np.all(np.diff(squarem.mle_retvals.llf[:-1]) >= -1e-4)
+    # The initialization of the model is left as it was
+    assert model.ssm.initialization is squarem.mle_retvals.inits[0]
+
+def test_squarem_results_restore(model):
+    # The parameters and the initial state estimated with them rebuild the results, as for `fit`
+    squarem = fit_squarem(model)
+    restored = restore_results(model, (squarem.params, squarem.mle_retvals.inits[-1]))
+    assert restored.llf == pytest.approx(squarem.llf, abs = 1e-9)
+    np.testing.assert_allclose(restored.smoothed_state, squarem.smoothed_state, atol = 1e-9)
+
+def test_warm_squarem(model):
+    # Warm-started from converged estimates, SQUAREM stops after a few EM iterations at the same likelihood
+    em = model.fit()
+    warm = fit_warm(model, (em.params, None), method = "squarem")
+    assert warm.mle_retvals.iter <= 5
+    assert warm.llf == pytest.approx(em.llf, rel = 1e-5)
+    with pytest.raises(ValueError):
+        fit_warm(model, method = "newton")
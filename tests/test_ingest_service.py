@@ -0,0 +1,80 @@
+# %%
+# The service loop of the ingestion service: debounce of new workbooks and retries of failed runs, without
+# running the pipeline (runs happen in a thread here, with run_dates replaced)
+import os
+import json
+import time
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+import ingest_service
+from ingest_service import IngestService
+
+VINTAGE = "econdata_nowcast_data_05_01_2024.xlsx"
+
+# %%
+@pytest.fixture
+def service(tmp_path):
+    dirs = {name: tmp_path / name for name in ["vintages", "inbox", "output", "state"]}
+    for path in dirs.values():
+        path.mkdir()
+    s = IngestService(str(dirs["vintages"]), str(dirs["output"]), inbox = str(dirs["inbox"]),
+                      cache_dir = str(tmp_path / "cache"), state_dir = str(dirs["state"]), artifact_dir = None,
+                      debounce = 0.5, retry_delay = 0.05, max_attempts = 3)
+    s.runner.shutdown()
+    s.runner = ThreadPoolExecutor(1)
+    yield s
+    s.validator.shutdown(wait = True)
+    s.runner.shutdown(wait = True)
+
+def events(s):
+    with open(s.events_path) as f:
+        return [json.loads(line) for line in f]
+
+def run_until_idle(s, timeout = 10):
+    start = time.monotonic()
+    while not s.step():
+        assert time.monotonic() - start < timeout, "the service did not become idle"
+        time.sleep(0.01)
+
+def test_debounce(service):
+    # A workbook still being written is not read until the inbox has been quiet for the debounce period
+    path = os.path.join(service.inbox, VINTAGE)
+    with open(path, "wb") as f:
+        f.write(b"partial")
+    service.step()
+    assert service.changed and service.validation is None
+    time.sleep(0.3)
+    with open(path, "ab") as f:
+        f.write(b" workbook")
+    service.step()
+    # Quiet since the first write for longer than the debounce period, but not since the last one
+    time.sleep(0.3)
+    service.step()
+    assert service.changed and service.validation is None
+    time.sleep(0.3)
+    run_until_idle(service)
+    # Not a workbook: reported as invalid and left in the inbox
+    assert [e["event"] for e in events(service)] == ["invalid"]
+    assert service.state[VINTAGE]["status"] == "invalid" and os.path.exists(path)
+
+def test_failed_runs_are_retried(service, monkeypatch):
+    calls = []
+    def run_dates(dates, **kwargs):
+        calls.append((time.monotonic(), dates))
+        raise RuntimeError("run failed")
+    monkeypatch.setattr(ingest_service, "run_dates", run_dates)
+    service.pending["2024Q1"] = {"2024-01-05"}
+    service.step()
+    # Dates arriving while the quarter waits for its retry are run with the failed ones
+    while not service.retries:
+        service.step()
+        time.sleep(0.01)
+    service.pending["2024Q1"] = {"2024-01-12"}
+    run_until_idle(service)
+    failed = [e for e in events(service) if e["event"] == "run_failed"]
+    assert [e["attempts"] for e in failed] == [1, 2, 3]
+    assert [e.get("retry_in") for e in failed] == [0.05, 0.1, None]
+    assert [dates for _, dates in calls] == [["2024-01-05"]] + 2 * [["2024-01-05", "2024-01-12"]]
+    # The retries wait for the backoff, and the failures of the quarter are reset after the last attempt
+    assert calls[2][0] - calls[1][0] >= 0.1
+    assert not service.failures and not service.retries
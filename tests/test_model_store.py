@@ -0,0 +1,77 @@
+# %%
+# Parameter store: estimates restored from a stored vintage give the published nowcast without EM, and are
+# only restored when they were made on the same data
+import os
+import numpy as np
+from conftest import QUARTER, FIRST_VINTAGE, SECOND_VINTAGE, VINTAGE_DIR, TOL, published_nowcast
+from nowcast_model import load_vintage, refit_model
+from em_acceleration import nowcast_values
+from model_store import (save_params, load_params, load_model, restore_results, stored_data_match, warm_start,
+                         fit_warm, em_iterations)
+
+# %%
+def test_fit_gives_published_nowcast(first_fit):
+    nowcast = nowcast_values(first_fit["results"], QUARTER)
+    published = published_nowcast(FIRST_VINTAGE)
+    assert max(abs(nowcast[k] - published[k]) for k in nowcast) < TOL
+
+def test_restore_then_predict_equals_stored_nowcast(first_fit, tmp_path):
+    results = first_fit["results"]
+    save_params(str(tmp_path), QUARTER, FIRST_VINTAGE, results)
+    # From the file alone: the stored model data, standardization and specification
+    model = load_model(str(tmp_path), QUARTER, FIRST_VINTAGE)
+    restored = restore_results(model, load_params(str(tmp_path), QUARTER, FIRST_VINTAGE, model))
+    assert abs(restored.llf - results.llf) < 1e-9 * abs(results.llf)
+    restored_nowcast, nowcast = nowcast_values(restored, QUARTER), nowcast_values(results, QUARTER)
+    assert max(abs(restored_nowcast[k] - nowcast[k]) for k in nowcast) < 1e-12
+    # On the model of the workbook: the same smoothing pass as the one EM ended with
+    restored = restore_results(first_fit["model"], load_params(str(tmp_path), QUARTER, FIRST_VINTAGE, first_fit["model"]))
+    assert nowcast_values(restored, QUARTER) == nowcast_values(results, QUARTER)
+    # Saving restored results stores the same estimates
+    save_params(str(tmp_path / "again"), QUARTER, FIRST_VINTAGE, restored)
+    for a, b in zip(load_params(str(tmp_path), QUARTER, FIRST_VINTAGE), load_params(str(tmp_path / "again"), QUARTER, FIRST_VINTAGE)):
+        if isinstance(a, np.ndarray):
+            assert np.array_equal(a, b)
+        else:
+            assert np.array_equal(a.constant, b.constant) and np.array_equal(a.stationary_cov, b.stationary_cov)
+
+def test_stored_data_match(first_fit, cache_dir, tmp_path):
+    save_params(str(tmp_path), QUARTER, FIRST_VINTAGE, first_fit["results"])
+    assert stored_data_match(str(tmp_path), QUARTER, FIRST_VINTAGE, first_fit["model"])
+    assert not stored_data_match(str(tmp_path), QUARTER, SECOND_VINTAGE, first_fit["model"])
+    # The next vintage of 2024Q1 has the same data, so its stored estimates can be restored
+    data = load_vintage(os.path.join(VINTAGE_DIR, SECOND_VINTAGE), cache_dir)
+    save_params(str(tmp_path), QUARTER, SECOND_VINTAGE, first_fit["results"])
+    assert stored_data_match(str(tmp_path), QUARTER, SECOND_VINTAGE, refit_model(first_fit["model"], data))
+    # A revision of a single observation
+    monthly = data["data_logdiff"].copy()
+    row, col = np.argwhere(monthly.notna().to_numpy())[-1]
+    monthly.iloc[row, col] += 1e-6
+    revised = refit_model(first_fit["model"], dict(data_logdiff = monthly, gdp_logdiff = data["gdp_logdiff"]))
+    assert not stored_data_match(str(tmp_path), QUARTER, SECOND_VINTAGE, revised)
+
+def test_warm_fit_on_same_data(first_fit):
+    # EM from the estimates on the data they were made on stops within a few iterations, at the same llf
+    results = first_fit["results"]
+    warm = fit_warm(first_fit["model"], warm_start(results))
+    assert em_iterations(warm) <= 5
+    assert abs(warm.llf - results.llf) < 1e-3 * abs(results.llf)
+
+def test_pipeline_rerun_restores(first_fit, cache_dir, tmp_path):
+    # A run on vintages with stored estimates for their data restores them: no EM, the stored file is not
+    # rewritten, and the nowcast is that of the stored results, on every rerun
+    from nowcast_pipeline import NowcastPipeline
+    params_dir = str(tmp_path / "dfm")
+    path = save_params(params_dir, QUARTER, FIRST_VINTAGE, first_fit["results"])
+    mtime = os.stat(path).st_mtime_ns
+    nowcasts = []
+    for _ in range(2):
+        pipeline = NowcastPipeline(VINTAGE_DIR, str(tmp_path / "nowcast"), date = "2024-01-12", params_dir = params_dir,
+                                   cache_dir = cache_dir, report_dir = str(tmp_path / "reports"), export = False)
+        pipeline.run()
+        assert next(s for s in pipeline.report.stages if s["stage"] == "fit")["restored"]
+        nowcasts.append(pipeline.nowcast)
+    assert os.stat(path).st_mtime_ns == mtime
+    expected = nowcast_values(first_fit["results"], QUARTER)
+    for nowcast in nowcasts:
+        assert nowcast.iloc[0][list(expected)].to_dict() == expected
@@ -0,0 +1,59 @@
+# %%
+# Scenarios on the fit of the first vintage of 2024Q1
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import NOWCAST_DIR, QUARTER, FIRST_VINTAGE, TOL, published_nowcast
+from nowcast_model import NOWCAST_VARIABLES, refit_model
+from model_store import restore_results, warm_start
+from scenarios import BASELINE, ScenarioEngine, check_baseline, scenario_table
+
+# %%
+@pytest.fixture(scope = "module")
+def engine(first_fit):
+    engine = ScenarioEngine(first_fit["results"], first_fit["data"], QUARTER)
+    engine.vintage = FIRST_VINTAGE
+    return engine
+
+def unreleased(engine, n = 2):
+    # The first n series not released in the last month of the vintage
+    month = engine.monthly.index[-1]
+    cells = [(series, str(month)) for series in engine.monthly.columns[engine.monthly.loc[month].isna()][:n]]
+    assert len(cells) == n
+    return cells
+
+def test_baseline_is_published_nowcast(engine):
+    np.testing.assert_allclose(engine.baseline[NOWCAST_VARIABLES], published_nowcast(FIRST_VINTAGE), rtol = 0, atol = TOL)
+    assert check_baseline(engine, NOWCAST_DIR, TOL)
+
+def test_scenarios_are_linear(engine):
+    cells = unreleased(engine)
+    forecasts, _ = engine.weights([engine.cell(*c) for c in cells], np.zeros(len(cells)))
+    table = scenario_table({"forecast": {s: {p: f} for (s, p), f in zip(cells, forecasts)},
+                            "up": {s: {p: f + 1.0} for (s, p), f in zip(cells, forecasts)},
+                            "down": {s: {p: f - 1.0} for (s, p), f in zip(cells, forecasts)}})
+    nowcasts, news = engine.run(table)
+    nowcasts = nowcasts.set_index("scenario")[NOWCAST_VARIABLES]
+    # Releases at their forecasts leave the nowcast unchanged, and impacts are symmetric around them
+    np.testing.assert_allclose(nowcasts.loc["forecast"], nowcasts.loc[BASELINE], rtol = 0, atol = 1e-10)
+    np.testing.assert_allclose(nowcasts.loc["up"] - nowcasts.loc[BASELINE],
+                               nowcasts.loc[BASELINE] - nowcasts.loc["down"], rtol = 0, atol = 1e-10)
+    impacts = news.groupby(["scenario", "impacted variable"])["impact"].sum().unstack()[NOWCAST_VARIABLES]
+    np.testing.assert_allclose(impacts.loc["up"], nowcasts.loc["up"] - nowcasts.loc[BASELINE], rtol = 0, atol = 1e-10)
+
+def test_scenario_is_nowcast_on_updated_data(engine):
+    # The nowcast of a scenario is that of the latest estimates applied to the data with its releases
+    cells = unreleased(engine)
+    values = np.array([0.5, -0.5])
+    nowcasts, _ = engine.run(scenario_table({"s": {s: {p: v} for (s, p), v in zip(cells, values)}}))
+    data = engine.updated_data([engine.cell(*c) for c in cells], values)
+    updated = restore_results(refit_model(engine.results.model, data), warm_start(engine.results))
+    expected = updated.get_prediction(start = engine.month).predicted_mean[NOWCAST_VARIABLES].iloc[0]
+    np.testing.assert_allclose(nowcasts.set_index("scenario").loc["s", NOWCAST_VARIABLES], expected,
+                               rtol = 0, atol = 1e-8)
+
+def test_released_cell_is_rejected(engine):
+    series = engine.monthly.columns[0]
+    period = str(engine.monthly[series].last_valid_index())
+    with pytest.raises(ValueError):
+        engine.run(pd.DataFrame([["s", series, period, 0.0]], columns = ["scenario", "series", "period", "value"]))
@@ -0,0 +1,61 @@
+# %%
+# Change sets between vintages, on synthetic panels
+import numpy as np
+import pandas as pd
+from nowcast_model import NOWCAST_VARIABLES
+from vintage_diff import NEW_RELEASE, REVISION, diff_frames, diff_vintages
+
+# %%
+def vintage(monthly, quarterly = None):
+    months = pd.period_range("2023-01", periods = len(monthly), freq = "M", name = "date")
+    if quarterly is None:
+        quarterly = np.ones((2, len(NOWCAST_VARIABLES)))
+    quarters = pd.period_range("2023Q1", periods = len(quarterly), freq = "Q", name = "date")
+    return dict(data_logdiff = pd.DataFrame(monthly, index = months, columns = ["a", "b"]),
+                gdp_logdiff = pd.DataFrame(quarterly, index = quarters, columns = NOWCAST_VARIABLES))
+
+OLD = [[1.0, 2.0], [2.0, 4.0], [3.0, np.nan]]
+
+def test_unchanged():
+    changes = diff_vintages(vintage(OLD), vintage(OLD))
+    assert changes.empty and changes.update_mode() == "skip"
+
+def test_new_releases_are_filtered():
+    # A new month and a missing value released
+    new = vintage(OLD + [[4.0, 5.0]])
+    new["data_logdiff"].iloc[2, 1] = 6.0
+    changes = diff_vintages(vintage(OLD), new)
+    assert changes.count(NEW_RELEASE) == 3 and changes.count(REVISION) == 0
+    assert changes.update_mode() == "filter"
+
+def test_numerical_noise_is_not_a_revision():
+    new = vintage(np.array(OLD) + 1e-12)
+    assert diff_vintages(vintage(OLD), new).update_mode() == "skip"
+
+def test_any_revision_refits():
+    # A revision of 1e-6 sd triggers a refit by default, and is filtered with a looser tolerance
+    new = vintage(OLD)
+    new["data_logdiff"].iloc[0, 0] += 1e-6
+    changes = diff_vintages(vintage(OLD), new)
+    assert changes.count(REVISION) == 1 and changes.max_revision < 1e-5
+    assert changes.update_mode() == "refit"
+    assert changes.update_mode(0.5) == "filter"
+    new["data_logdiff"].iloc[1, 0] += 1.0
+    assert diff_vintages(vintage(OLD), new).update_mode(0.5) == "refit"
+
+def test_withdrawn_and_quarterly_revisions_refit():
+    new = vintage(OLD)
+    new["data_logdiff"].iloc[1, 1] = np.nan
+    changes = diff_vintages(vintage(OLD), new)
+    assert changes.count(REVISION) == 1 and changes.max_revision == np.inf
+    assert changes.update_mode(0.5) == "refit"
+    quarterly = np.ones((2, len(NOWCAST_VARIABLES)))
+    quarterly[1, 0] = 1.5
+    assert diff_vintages(vintage(OLD), vintage(OLD, quarterly)).update_mode() == "refit"
+
+def test_diff_frames_columns():
+    old = pd.DataFrame({"a": [1.0, np.nan]}, index = pd.period_range("2023-01", periods = 2, freq = "M"))
+    new = pd.DataFrame({"a": [1.5, 2.0], "b": [1.0, np.nan]}, index = old.index)
+    changes = diff_frames(old, new)
+    assert list(changes.change) == [REVISION, NEW_RELEASE, NEW_RELEASE]
+    assert list(changes.variable) == ["a", "b", "a"]